@@ -0,0 +1,322 @@
+"""簡易ベンチマーク集
+
+使い方（backend ディレクトリで）:
+    python bench.py serve        # 開発サーバー vs gunicorn
+    python bench.py cache        # プロセス内 dict vs 共有 SQLite キャッシュ
+    python bench.py wire         # /api/stations の転送形式ごとのサイズとエンコード時間
+    python bench.py json         # Flask 既定 JSON プロバイダ vs orjson プロバイダ
+    python bench.py congestion   # 混雑度インデックスの構築時間・メモリ・参照時間
+    python bench.py search       # 駅名検索の参照時間（合成データで駅数を増やしたとき）
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[idx]
+
+
+def _report(label, latencies_ms, elapsed_s):
+    print(
+        f"{label:<28} n={len(latencies_ms):>5}  "
+        f"rps={len(latencies_ms) / elapsed_s:>8.1f}  "
+        f"p50={statistics.median(latencies_ms):>7.2f}ms  "
+        f"p99={_percentile(latencies_ms, 99):>7.2f}ms"
+    )
+
+
+def _wait_until_up(url, timeout_s=20):
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _hammer(url, requests_total, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        urllib.request.urlopen(url, timeout=30).read()
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(requests_total)))
+    return latencies, time.perf_counter() - start
+
+
+def bench_serve(args):
+    """Flask 開発サーバーと gunicorn（gunicorn.conf.py）のスループット比較"""
+    servers = {
+        "dev server": [sys.executable, "main.py"],
+        "gunicorn": ["gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+    }
+    paths = ["/api/stations", "/api/stations?line_id=yamanote"]
+
+    for label, cmd in servers.items():
+        port = str(args.port)
+        env = dict(os.environ, PORT=port, ODPT_API_KEY="", STATION_WATCH_INTERVAL="0")
+        proc = subprocess.Popen(
+            cmd,
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            base = f"http://127.0.0.1:{port}"
+            if not _wait_until_up(base + "/api/lines"):
+                print(f"{label}: failed to start")
+                continue
+            for path in paths:
+                latencies, elapsed = _hammer(
+                    base + path, args.requests, args.concurrency
+                )
+                _report(f"{label} {path}", latencies, elapsed)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def _cache_worker(path, keys):
+    from shared_cache import SharedCache
+
+    shared = SharedCache(path=path)
+    return sum(1 for k in keys if shared.get(k) is not None)
+
+
+def bench_cache(args):
+    """プロセス内 dict と SharedCache の get/set 速度、ワーカー間ヒット数の比較"""
+    import tempfile
+
+    from shared_cache import SharedCache
+
+    keys = [f"gpt:station{i}" for i in range(1000)]
+    value = ("あ" * 700).encode()  # Gemini 応答程度（約2KB）
+
+    local = {}
+    start = time.perf_counter()
+    for k in keys:
+        local[k] = value
+    set_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for k in keys:
+        local.get(k)
+    get_s = time.perf_counter() - start
+    print(
+        f"dict         set={set_s / len(keys) * 1e6:7.2f}us  get={get_s / len(keys) * 1e6:7.2f}us"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        shared = SharedCache(path=path)
+        start = time.perf_counter()
+        for k in keys:
+            shared.set(k, value, 3600)
+        set_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for k in keys:
+            shared.get(k)
+        get_s = time.perf_counter() - start
+        print(
+            f"SharedCache  set={set_s / len(keys) * 1e6:7.2f}us  get={get_s / len(keys) * 1e6:7.2f}us"
+        )
+
+        # 別プロセス（=別ワーカー）から見たヒット数。dict なら全てコールドミスになる
+        workers = 4
+        with multiprocessing.Pool(workers) as pool:
+            hits = pool.starmap(_cache_worker, [(path, keys)] * workers)
+        print(
+            f"cross-worker hits: SharedCache={sum(hits)}/{workers * len(keys)}  dict=0/{workers * len(keys)}"
+        )
+
+
+def _time_per_call(fn, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_wire(args):
+    """jsonify 相当と、列指向 JSON / MessagePack の payload サイズ・エンコード時間"""
+    import json
+
+    import dataset
+    import wire
+
+    ds = dataset.load()
+
+    def flask_jsonify():
+        # Flask の既定 jsonify（ensure_ascii=True・区切り詰め）と同じ出力
+        return json.dumps(ds.stations, separators=(",", ":")).encode()
+
+    candidates = {"jsonify (current)": flask_jsonify}
+    for fmt in wire.MIMETYPES:
+        candidates[f"{fmt} (uncached)"] = lambda fmt=fmt: wire.encode(
+            ds.stations, ds.lines, fmt
+        )
+        candidates[f"{fmt} (cached)"] = lambda fmt=fmt: ds.encoded(fmt)
+
+    for label, fn in candidates.items():
+        size = len(fn())
+        print(f"{label:<22} {size:>7} bytes  {_time_per_call(fn):8.4f}ms/encode")
+
+
+def bench_json(args):
+    """/api/stations のエンコード時間とレスポンスサイズ（Flask 既定 vs orjson）"""
+    from flask.json.provider import DefaultJSONProvider
+
+    import dataset
+    import main
+    from json_provider import OrjsonProvider
+
+    ds = dataset.load()
+    client = main.app.test_client()
+    providers = {
+        "flask default": DefaultJSONProvider(main.app),
+        "orjson": OrjsonProvider(main.app),
+    }
+    for label, provider in providers.items():
+        encode_ms = _time_per_call(lambda: provider.dumps(ds.stations))
+        main.app.json = provider
+        with main.app.app_context():
+            size = len(provider.response(ds.stations).get_data())
+        # エンコード済みキャッシュを通らない経路（近傍検索）で1リクエストあたりの時間
+        request_ms = _time_per_call(
+            lambda: client.get("/api/stations/near?lat=35.68&lng=139.76&radius_km=50"),
+            repeat=50,
+        )
+        print(
+            f"{label:<14} /api/stations {size:>6} bytes  encode={encode_ms:.4f}ms  "
+            f"/api/stations/near request={request_ms:.3f}ms"
+        )
+    main.app.json = providers["orjson"]
+
+
+def bench_congestion(args):
+    """乗降人員データからの混雑度インデックス構築（駅数を増やしたとき）と O(1) 参照"""
+    import random
+    import tracemalloc
+
+    import congestion_index
+
+    for n in (100, 1_000, 10_000, 100_000):
+        names = [f"駅{i}" for i in range(n)]
+        ridership = {name: random.randint(1_000, 3_500_000) for name in names}
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = congestion_index.CongestionIndex(names, ridership)
+        build_ms = (time.perf_counter() - started) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        ids = [random.randrange(n) for _ in range(1000)]
+        lookup_us = (
+            _time_per_call(lambda: [index.level(i, 8) for i in ids], repeat=20)
+            / len(ids)
+            * 1000
+        )
+        print(
+            f"stations={n:>7}  build={build_ms:8.2f}ms  "
+            f"index={index.nbytes / 1024:9.1f}KB  build peak={peak / 1024:9.1f}KB  "
+            f"level()={lookup_us:.3f}us"
+        )
+
+
+def synthetic_stations(n, seed=0):
+    """実データに、よくある音の組み合わせの合成駅を足した n 駅の (駅リスト, 路線リスト)
+
+    駅名検索のベンチマークと tests/test_station_search.py で共有する。
+    """
+    import random
+
+    import dataset
+    from station_search import romaji_to_hiragana
+
+    ds = dataset.current()
+    syllables = [
+        "ka", "shi", "ma", "ta", "na", "mi", "ya", "shin", "ju", "ku",
+        "se", "ri", "to", "ko", "ha", "bu", "no", "sa", "wa", "da",
+    ]  # fmt: skip
+    rng = random.Random(seed)
+    station_list = list(ds.stations)
+    seen = {s["name"] for s in station_list}
+    while len(seen) < n:
+        name_en = "".join(rng.choices(syllables, k=rng.randint(2, 4))).title()
+        name = romaji_to_hiragana(name_en) + "駅"
+        if name in seen:
+            continue
+        seen.add(name)
+        station_list.append(
+            {
+                "id": f"x{len(station_list)}",
+                "name": name,
+                "name_en": name_en,
+                "line_id": ds.lines[0]["id"],
+                "lat": 35.0 + rng.random(),
+                "lng": 139.0 + rng.random(),
+            }
+        )
+    return station_list, ds.lines
+
+
+def bench_search(args):
+    """駅名検索（前方一致・誤字許容）を駅数を増やした合成データで測る"""
+    import dataset
+    from station_model import StationModel
+    from station_search import StationSearch
+
+    queries = ["shibya", "kashima", "shinj", "sinjuku", "しぶや", "新宿", "tokyo"]
+    for n in (len(dataset.current().model), 1_000, 3_000, 10_000):
+        station_list, lines = synthetic_stations(n)
+        model = StationModel(station_list, lines)
+        started = time.perf_counter()
+        search = StationSearch(model, station_list)
+        build_ms = (time.perf_counter() - started) * 1000
+        timings = "  ".join(
+            f"{q}={_time_per_call(lambda: search.search(q, 35.68, 139.76), repeat=50):.3f}ms"
+            for q in queries
+        )
+        print(
+            f"stations={len(model):>6}  keys={len(search.keys):>6}  "
+            f"build={build_ms:7.1f}ms  {timings}"
+        )
+
+
+BENCHMARKS = {
+    "serve": bench_serve,
+    "cache": bench_cache,
+    "wire": bench_wire,
+    "json": bench_json,
+    "congestion": bench_congestion,
+    "search": bench_search,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == "__main__":
+    main()
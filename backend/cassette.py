@@ -0,0 +1,171 @@
+"""外部 API（ODPT・LLM）の記録と再生
+
+本番の遅さをオフラインで再現できるように、上流とのやり取りを所要時間付きで
+カセット（JSONL、1行1往復）に記録し、後から同じ応答を同じ（または倍率をかけた）
+遅延で返す。
+
+- ODPT: requests.Session に RecordingAdapter を mount して記録する。再生は
+  replay_server.py --cassette で HTTP サーバーとして行う（ODPT_BASE_URL をそこへ向ける）
+- LLM: 生成関数を record_llm で包んで記録し、LlmReplay でプロセス内で再生する
+
+    CASSETTE_RECORD=cassette.jsonl python main.py        # 記録
+    LLM_REPLAY=cassette.jsonl LLM_REPLAY_LATENCY_SCALE=1 python main.py  # LLM を再生
+"""
+
+import hashlib
+import itertools
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import orjson
+from requests.adapters import HTTPAdapter
+
+# 記録しないクエリ（API キーはカセットに残さない）
+SECRET_PARAMS = ("acl:consumerKey",)
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+def request_key(method, url):
+    """メソッド + パス + （秘密を除いて並べ替えた）クエリ"""
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS)
+    return f"{method} {parts.path}?{urlencode(query)}"
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(str(prompt).encode()).hexdigest()[:32]
+
+
+class Cassette:
+    """追記専用の JSONL。1回の write で1行書くので複数ワーカーから追記しても混ざらない"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, entry):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, orjson.dumps(entry) + b"\n")
+        finally:
+            os.close(fd)
+
+    def entries(self, service=None):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as f:
+            rows = [orjson.loads(line) for line in f if line.strip()]
+        return [r for r in rows if service is None or r["service"] == service]
+
+
+class RecordingAdapter(HTTPAdapter):
+    """requests の送受信を所要時間付きでカセットに書く"""
+
+    def __init__(self, cassette, service="odpt", **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        self.service = service
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        # 本文を読み切るまでを所要時間に含める
+        body = response.content
+        self.cassette.append(
+            {
+                "service": self.service,
+                "key": request_key(request.method, request.url),
+                "status": response.status_code,
+                "headers": {
+                    h: response.headers[h]
+                    for h in KEPT_HEADERS
+                    if h in response.headers
+                },
+                "body": body.decode("utf-8", errors="replace"),
+                "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+                "recorded_at": time.time(),
+            }
+        )
+        return response
+
+
+def record_session(session, cassette, service="odpt"):
+    adapter = RecordingAdapter(cassette, service)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def record_llm(generate, cassette):
+    """generate(prompt, **kwargs) を包み、プロンプトと応答本文を記録する"""
+
+    def recording(prompt, *args, **kwargs):
+        started = time.perf_counter()
+        response = generate(prompt, *args, **kwargs)
+        cassette.append(
+            {
+                "service": "llm",
+                "key": prompt_key(prompt),
+                "status": 200,
+                "body": response.text,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+                "recorded_at": time.time(),
+            }
+        )
+        return response
+
+    return recording
+
+
+class ReplayedResponse:
+    """generate_content の戻り値のうち、呼び出し側が使う .text だけを持つ"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Player:
+    """キーごとに記録順で巡回して返す。未記録のキーは全記録を巡回する
+
+    負荷試験ではプロンプト（推定分数など）が記録時と一致しないことが多いので、
+    未一致でも記録された遅延分布のまま何かしらの応答を返す。
+    """
+
+    def __init__(self, entries, latency_scale=1.0):
+        if not entries:
+            raise ValueError("cassette has no entries to replay")
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        by_key = {}
+        for entry in entries:
+            by_key.setdefault(entry["key"], []).append(entry)
+        self._by_key = {key: itertools.cycle(rows) for key, rows in by_key.items()}
+        self._any = itertools.cycle(entries)
+        self.hits = 0
+        self.misses = 0
+
+    def next(self, key):
+        """(記録, 完全一致したか) を返す。遅延はまだ待たない"""
+        with self._lock:
+            rows = self._by_key.get(key)
+            if rows is not None:
+                self.hits += 1
+                return next(rows), True
+            self.misses += 1
+            return next(self._any), False
+
+    def wait(self, entry):
+        time.sleep(entry["latency_ms"] / 1000 * self.latency_scale)
+
+
+class LlmReplay:
+    """記録した LLM 応答をプロセス内で再生する（model.generate_content の代わり）"""
+
+    def __init__(self, path, latency_scale=1.0):
+        self.player = Player(Cassette(path).entries("llm"), latency_scale)
+
+    def __call__(self, prompt, *args, **kwargs):
+        entry, _ = self.player.next(prompt_key(prompt))
+        self.player.wait(entry)
+        return ReplayedResponse(entry["body"])
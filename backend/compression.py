@@ -0,0 +1,239 @@
+"""レスポンス圧縮（brotli / zstd / gzip）
+
+利用者はトンネル内のモバイル回線にいるので、駅リストや予測 JSON などの
+動的レスポンスを Accept-Encoding に応じて圧縮する。
+
+- MIN_SIZE 未満の小さな本文は圧縮しない（ヘッダと CPU の無駄）
+- text/event-stream などのストリームはチャンクごとに圧縮して flush する
+- ETag 付き（キャッシュ可能）のレスポンスは高圧縮でエンコードし、結果を保持する
+- エンドポイントごとに CPU 時間と削減バイト数を集計する
+
+    compression.init_app(app)
+"""
+
+import gzip
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli が無い環境では gzip/zstd のみ
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MIN_SIZE = 1024
+CACHE_ENTRIES = 256
+
+_COMPRESSIBLE = (
+    "application/json",
+    "application/javascript",
+    "application/vnd.ibs.columnar+json",
+    "application/x-msgpack",
+    "image/svg+xml",
+)
+
+
+def _available():
+    # サーバー側の優先順（同じ q 値ならこの順で選ぶ）
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate(accept_encoding):
+    """Accept-Encoding（q 値付き）から使う圧縮方式を選ぶ。なければ None"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in _available():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, high=False):
+    """一括圧縮。high=True はキャッシュする（1回しか圧縮しない）本文向けの高圧縮"""
+    if encoding == "br":
+        return brotli.compress(data, quality=9 if high else 5)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=12 if high else 3).compress(data)
+    return gzip.compress(data, compresslevel=9 if high else 6)
+
+
+def _stream_compressor(encoding):
+    """(compress(chunk), flush(), finish()) を返す。flush でチャンク境界ごとに送り出す"""
+    if encoding == "br":
+        c = brotli.Compressor(quality=5)
+        return c.process, c.flush, c.finish
+    if encoding == "zstd":
+        c = zstandard.ZstdCompressor(level=3).compressobj()
+        return (
+            c.compress,
+            lambda: c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            c.flush,
+        )
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_endpoint = {}
+
+    def add(self, endpoint, raw, sent, cpu_s, cache_hit=False):
+        with self._lock:
+            s = self._by_endpoint.setdefault(
+                endpoint,
+                {
+                    "responses": 0,
+                    "raw_bytes": 0,
+                    "sent_bytes": 0,
+                    "cpu_ms": 0.0,
+                    "cache_hits": 0,
+                },
+            )
+            s["responses"] += 1
+            s["raw_bytes"] += raw
+            s["sent_bytes"] += sent
+            s["cpu_ms"] += cpu_s * 1000
+            s["cache_hits"] += int(cache_hit)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for endpoint, s in self._by_endpoint.items():
+                saved = s["raw_bytes"] - s["sent_bytes"]
+                result[endpoint] = {
+                    **s,
+                    "cpu_ms": round(s["cpu_ms"], 3),
+                    "saved_bytes": saved,
+                    "ratio": (
+                        round(s["sent_bytes"] / s["raw_bytes"], 3)
+                        if s["raw_bytes"]
+                        else None
+                    ),
+                    "saved_bytes_per_cpu_ms": (
+                        round(saved / s["cpu_ms"]) if s["cpu_ms"] else None
+                    ),
+                }
+            return result
+
+
+stats = _Stats()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cached_compress(key, data, encoding):
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit, True
+    compressed = compress(data, encoding, high=True)
+    with _cache_lock:
+        _cache[key] = compressed
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return compressed, False
+
+
+def _is_compressible(mimetype):
+    return mimetype.startswith("text/") or mimetype in _COMPRESSIBLE
+
+
+def _stream(chunks, encoding, endpoint):
+    process, flush, finish = _stream_compressor(encoding)
+    raw = sent = 0
+    cpu = 0.0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        started = time.process_time()
+        out = process(chunk) + flush()
+        cpu += time.process_time() - started
+        raw += len(chunk)
+        sent += len(out)
+        yield out
+    out = finish()
+    sent += len(out)
+    stats.add(endpoint, raw, sent, cpu)
+    yield out
+
+
+def _after_request(response):
+    if (
+        request.method == "HEAD"
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or not _is_compressible(response.mimetype)
+    ):
+        return response
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    endpoint = request.endpoint or "unknown"
+
+    # SSE などのストリームは逐次圧縮する
+    if response.is_streamed or response.mimetype == "text/event-stream":
+        if response.direct_passthrough:
+            return response
+        response.response = _stream(response.response, encoding, endpoint)
+        response.headers["Content-Encoding"] = encoding
+        response.headers.pop("Content-Length", None)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    etag, _ = response.get_etag()
+    cacheable = etag is not None and "no-store" not in response.headers.get(
+        "Cache-Control", ""
+    )
+    started = time.process_time()
+    if cacheable:
+        compressed, hit = _cached_compress((etag, encoding), data, encoding)
+    else:
+        compressed, hit = compress(data, encoding), False
+    stats.add(endpoint, len(data), len(compressed), time.process_time() - started, hit)
+
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    if etag is not None:
+        # 表現が変わるので弱い ETag にする（If-None-Match は弱い比較なので 304 は効く）
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(_after_request)
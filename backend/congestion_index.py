@@ -0,0 +1,172 @@
+"""駅 × 時間帯の混雑度インデックス（ODPT 乗降人員データから前計算）
+
+get_congestion_info は全駅共通の時間帯テーブルから絵文字を出すだけで、所要時間の
+推定には使われていなかった。ここでは ODPT の odpt:PassengerSurvey（駅ごとの
+1日あたり乗降人員）を取り込み、
+
+    混雑度[駅, 時] = 時間帯の基準値[時] × (0.5 + 乗降人員の相対規模[駅])
+
+を 0-10 の uint8 で (物理駅数, 24) の配列に前計算する（1駅あたり24バイト）。
+取り込み結果は駅名 → 乗降人員の小さな JSON として保存し、配列は Dataset の構築時に
+物理駅 id の順に並べて作る。
+所要時間の推定とトイレ駅ランキングは level(駅, 時) / column(時) で O(1) に読む。
+データが無い駅は相対規模 0.5（= 従来の全駅共通テーブルと同じ値）になる。
+
+取り込み（backend ディレクトリで）:
+    python congestion_index.py --input survey.json        # 保存済みの API 応答から
+    python congestion_index.py --fetch                    # ODPT_BASE_URL から取得
+"""
+
+import argparse
+import os
+
+import numpy as np
+import orjson
+
+# 時間帯ごとの混雑度パターン（0-10段階、10が最も混雑）
+CONGESTION_PATTERN = {
+    (7, 9): 8,  # 朝ラッシュ: 非常に混雑
+    (9, 11): 6,  # 朝から昼: やや混雑
+    (11, 14): 3,  # 昼間: 空いている
+    (14, 16): 4,  # 午後: 少し混雑
+    (16, 19): 7,  # 夕方ラッシュ: 混雑
+    (19, 21): 5,  # 夜間: やや混雑
+}
+# 上記以外の時間（21-7時）は空いている
+OFF_PEAK_LEVEL = 2
+
+# 混雑度1段階あたりの所要時間の上乗せ（分）。ホームや改札を抜けるのに時間がかかる
+MINUTES_PER_LEVEL = 0.3
+
+DEFAULT_PATH = os.environ.get(
+    "CONGESTION_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "congestion_index.json"),
+)
+
+
+def hourly_levels():
+    """0-23時それぞれの基準の混雑度"""
+    levels = [OFF_PEAK_LEVEL] * 24
+    for (start, end), level in CONGESTION_PATTERN.items():
+        for hour in range(start, end):
+            levels[hour] = level
+    return levels
+
+
+def _match_key(text):
+    return "".join(c for c in text.lower() if c.isalnum())
+
+
+def ridership_by_name(survey_records, station_list):
+    """PassengerSurvey のレコードを駅名ごとの1日の乗降人員（最新年度、事業者合算）にする
+
+    odpt:station の URN の末尾（"odpt.Station:JR-East.Yamanote.Shinjuku" → "Shinjuku"）
+    を駅データの name_en と照合する。
+    """
+    by_en = {}
+    for s in station_list:
+        if s.get("name_en"):
+            by_en.setdefault(_match_key(s["name_en"]), s["name"])
+
+    totals = {}
+    for record in survey_records:
+        surveys = record.get("odpt:passengerSurveyObject") or []
+        if not surveys:
+            continue
+        latest = max(surveys, key=lambda x: x.get("odpt:surveyYear", 0))
+        journeys = latest.get("odpt:passengerJourneys") or 0
+        names = {
+            by_en.get(_match_key(urn.rsplit(".", 1)[-1]))
+            for urn in record.get("odpt:station") or []
+        }
+        for name in names - {None}:
+            totals[name] = totals.get(name, 0) + journeys
+    return totals
+
+
+def save(ridership, path=DEFAULT_PATH):
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(ridership, option=orjson.OPT_SORT_KEYS))
+
+
+def load_ridership(path=DEFAULT_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+class CongestionIndex:
+    def __init__(self, names, ridership):
+        """names は物理駅 id 順の駅名、ridership は 駅名 → 1日の乗降人員"""
+        counts = np.array([ridership.get(name, 0) for name in names], dtype=np.float64)
+        known = counts > 0
+        # 乗降人員は桁で効くので対数で 0-1 に正規化する。データの無い駅は中央の 0.5
+        scale = np.full(len(names), 0.5)
+        if known.sum() >= 2:
+            logs = np.log10(counts[known])
+            spread = logs.max() - logs.min()
+            scale[known] = (logs - logs.min()) / spread if spread else 0.5
+        self.covered = int(known.sum())
+
+        hourly = np.array(hourly_levels(), dtype=np.float64)
+        self.index = np.clip(np.rint(np.outer(0.5 + scale, hourly)), 0, 10).astype(
+            np.uint8
+        )
+
+    def level(self, station_id, hour):
+        return int(self.index[station_id, hour])
+
+    def column(self, hour):
+        """その時間帯の全物理駅の混雑度（コピーしないビュー）"""
+        return self.index[:, hour]
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes
+
+
+def _fetch(base_url, api_key):
+    import requests
+
+    params = {"acl:consumerKey": api_key} if api_key else {}
+    response = requests.get(
+        f"{base_url.rstrip('/')}/odpt:PassengerSurvey", params=params, timeout=60
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    import dataset
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="保存済みの odpt:PassengerSurvey 応答 (JSON)")
+    source.add_argument("--fetch", action="store_true", help="ODPT から取得する")
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    if args.fetch:
+        records = _fetch(
+            os.environ.get("ODPT_BASE_URL", "https://api.odpt.org/api/v4"),
+            os.environ.get("ODPT_API_KEY"),
+        )
+    else:
+        with open(args.input, "rb") as f:
+            records = orjson.loads(f.read())
+
+    ds = dataset.load()
+    ridership = ridership_by_name(records, ds.stations)
+    save(ridership, args.out)
+    print(
+        f"✅ {len(ridership)}/{len(ds.model)} stations matched "
+        f"from {len(records)} survey records -> {args.out}"
+    )
+    if ridership:
+        busiest = max(ridership, key=ridership.get)
+        print(f"   busiest: {busiest} ({ridership[busiest]:,}/day)")
+
+
+if __name__ == "__main__":
+    main()
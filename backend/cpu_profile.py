@@ -0,0 +1,147 @@
+"""サンプリング方式の CPU プロファイラ（ワーカー単位、必要なときだけ N 秒間動かす）
+
+ワーカーが熱くなったとき、時間が calculate_distance_km の三角関数なのか、
+駅リストの内包表記なのか、JSON 化なのかを本番でそのまま調べるためのもの。
+
+- 開始すると別スレッドが一定間隔で sys._current_frames() を読み、全スレッドの
+  スタックを記録する（対象コードに計測を仕込まないのでオーバーヘッドが小さい）
+- 各スタックには、前回のサンプルからそのスレッドが使った CPU 時間（マイクロ秒）を
+  足す。キュー待ちのタスクワーカーや sleep 中のポーラーなど、止まっているだけの
+  スレッドは CPU を使わないので結果に出ない。スレッドごとの CPU 時計が無い環境では
+  threading / queue / selectors で待っているスレッドを除いて1回ずつ数える
+- 停止していれば何もしない（スレッドもフックも無い）
+- 結果は flamegraph.pl / speedscope がそのまま読める collapsed 形式
+  （"根;...;葉 CPUマイクロ秒" の行）で、ワーカーごとに cpu-<pid>-<時刻>.folded に書く
+
+開始方法:
+    POST /api/debug/cpu-profile?seconds=30   （リクエストを受けたワーカーのみ）
+    kill -USR2 <ワーカーの pid>               （CPU_PROFILE_SECONDS 秒）
+"""
+
+import os
+import queue
+import selectors
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+INTERVAL_S = float(os.environ.get("CPU_PROFILE_INTERVAL_MS", 10)) / 1000
+SIGNAL_SECONDS = float(os.environ.get("CPU_PROFILE_SECONDS", 30))
+OUTPUT_DIR = os.environ.get("CPU_PROFILE_DIR", tempfile.gettempdir())
+MAX_SECONDS = 300
+
+# 葉のフレームがここにあるスレッドは待っているだけとみなす（CPU 時計が無いとき用）
+_IDLE_MODULES = {os.path.basename(m.__file__) for m in (threading, queue, selectors)}
+
+_lock = threading.Lock()
+_running = None
+last_output = None
+
+
+def _frame_label(code):
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _thread_cpu_s(ident):
+    """スレッドの累積 CPU 時間（秒）。取れない環境・終了したスレッドは None"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def _is_idle(frame):
+    return os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES
+
+
+def _collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, seconds, interval):
+        super().__init__(daemon=True, name="cpu-profiler")
+        self.seconds = seconds
+        self.interval = interval
+        self.samples = Counter()
+        self.path = os.path.join(
+            OUTPUT_DIR, f"cpu-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        )
+
+    def run(self):
+        global _running, last_output
+        me = threading.get_ident()
+        names = {}
+        last_cpu = {}
+        fallback_us = round(self.interval * 1_000_000)
+        deadline = time.monotonic() + self.seconds
+        try:
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    cpu = _thread_cpu_s(ident)
+                    if cpu is not None:
+                        # 前回からの CPU 時間を今のスタックに付ける（初回は 0）
+                        weight = round((cpu - last_cpu.get(ident, cpu)) * 1_000_000)
+                        last_cpu[ident] = cpu
+                    else:
+                        weight = 0 if _is_idle(frame) else fallback_us
+                    if weight <= 0:
+                        continue
+                    if ident not in names:
+                        names.update((t.ident, t.name) for t in threading.enumerate())
+                    self.samples[
+                        f"{names.get(ident, ident)};{_collapse(frame)}"
+                    ] += weight
+                time.sleep(self.interval)
+            with open(self.path, "w") as f:
+                for stack, cpu_us in self.samples.most_common():
+                    f.write(f"{stack} {cpu_us}\n")
+            last_output = self.path
+            print(
+                f"🔥 CPU profile written to {self.path} "
+                f"({sum(self.samples.values()) / 1000:.1f}ms CPU)"
+            )
+        finally:
+            with _lock:
+                _running = None
+
+
+def start(seconds, interval=INTERVAL_S):
+    """プロファイルを開始して出力先のパスを返す。実行中なら None"""
+    global _running
+    seconds = max(0.1, min(MAX_SECONDS, seconds))
+    with _lock:
+        if _running is not None:
+            return None
+        _running = _Sampler(seconds, interval)
+        _running.start()
+        return _running.path
+
+
+def status():
+    running = _running
+    return {
+        "pid": os.getpid(),
+        "running": running is not None,
+        "output": running.path if running is not None else last_output,
+    }
+
+
+def _on_signal(signum, frame):
+    start(SIGNAL_SECONDS)
+
+
+def install_signal_handler(signum=signal.SIGUSR2):
+    """SIGUSR2 で CPU_PROFILE_SECONDS 秒のプロファイルを始める（ワーカーごとに呼ぶ）"""
+    signal.signal(signum, _on_signal)
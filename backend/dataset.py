@@ -0,0 +1,179 @@
+import importlib
+import math
+import os
+import threading
+import time
+
+import orjson
+
+import congestion_index
+import stations
+import versioning
+import wire
+from geo_index import GeoIndex
+from station_model import StationModel
+from station_search import StationSearch
+from toilet_rank import ToiletRanker
+
+
+class Dataset:
+    """駅データと、そこから前計算したインデックス一式（読み取り専用）"""
+
+    def __init__(self, station_list, line_list):
+        self.stations = station_list
+        self.lines = line_list
+        self.line_colors = {l["id"]: l["color"] for l in line_list}
+        self.version = versioning.dataset_version(station_list)
+
+        # 路線ごとの駅リスト（line_color 付き）。get_stations_by_line と同じ内容を前計算
+        self.by_line = {}
+        for s in station_list:
+            line_id = s["line_id"].strip()
+            self.by_line.setdefault(line_id, []).append(
+                {**s, "line_color": self.line_colors.get(line_id, "#333333")}
+            )
+
+        # 距離計算用の座標行列（レコード単位）: (緯度rad, 経度rad, cos(緯度))
+        # リクエストごとの radians/cos 計算を省き、fork 後は各ワーカーで共有される
+        self.coords = [
+            (
+                math.radians(s["lat"]),
+                math.radians(s["lng"]),
+                math.cos(math.radians(s["lat"])),
+            )
+            for s in station_list
+        ]
+
+        # 物理駅（同名駅を1つにまとめたもの）と路線所属の正規化モデル
+        self.model = StationModel(station_list, line_list)
+
+        # 半径・矩形検索用のグリッド索引
+        self.geo_index = GeoIndex(station_list, self.coords)
+
+        # 駅名検索（漢字・かな・ローマ字）の索引
+        self.search = StationSearch(self.model, station_list)
+
+        # 駅 × 時間帯の混雑度（乗降人員データがあれば駅ごとに重み付け）
+        self.congestion = congestion_index.CongestionIndex(
+            self.model.names, congestion_index.load_ridership()
+        )
+
+        # 最短で着けるトイレのある駅のランキング用（物理駅ごとの NumPy 配列）
+        self.toilets = ToiletRanker(self.model, station_list)
+
+        # エンコード済みレスポンス本体: (形式, line_id) -> bytes
+        self._encoded = {}
+
+    def encoded(self, fmt, line_id=None):
+        """全駅（line_id 指定時はその路線）を fmt 形式でエンコードした bytes。初回のみ計算"""
+        key = (fmt, line_id)
+        body = self._encoded.get(key)
+        if body is None:
+            station_list = (
+                self.stations if line_id is None else self.by_line.get(line_id, [])
+            )
+            body = wire.encode(station_list, self.lines, fmt)
+            self._encoded[key] = body
+        return body
+
+
+# 駅データの読み込み元。STATIONS_DATA_PATH（{"lines": [...], "stations": [...]} の
+# JSON）があればそれを、なければ stations.py を使う
+STATIONS_DATA_PATH = os.environ.get("STATIONS_DATA_PATH")
+
+_current = None
+_source_mtime = None
+_reload_lock = threading.Lock()
+_listeners = []
+
+# 差分同期用に過去バージョンの駅リストを保持する
+history = versioning.VersionHistory()
+
+
+def source_path():
+    return STATIONS_DATA_PATH or os.path.abspath(stations.__file__)
+
+
+def read_file(path):
+    """{"lines": [...], "stations": [...]} の JSON から (駅リスト, 路線リスト) を読む"""
+    with open(path, "rb") as f:
+        data = orjson.loads(f.read())
+    return data["stations"], data["lines"]
+
+
+def _read_source(reload_module):
+    if STATIONS_DATA_PATH:
+        return read_file(STATIONS_DATA_PATH)
+    if reload_module:
+        importlib.reload(stations)
+    return stations.STATIONS, stations.ALL_LINES
+
+
+def _build(reload_module=False):
+    """読み込み元から Dataset を構築して差し替え、(旧, 新) を返す"""
+    global _current, _source_mtime
+    mtime = os.path.getmtime(source_path())
+    station_list, line_list = _read_source(reload_module)
+    new = Dataset(station_list, line_list)
+    history.record(new.version, new.stations)
+    old = _current
+    # 構築が終わってから参照を1回で差し替える（読み手は常に完成品を見る）
+    _current = new
+    _source_mtime = mtime
+    return old, new
+
+
+def load():
+    """駅データを読み込んで Dataset を構築する"""
+    with _reload_lock:
+        return _build()[1]
+
+
+def add_listener(callback):
+    """データ差し替え時に callback(旧 Dataset, 新 Dataset) を呼ぶ（キャッシュ無効化用）"""
+    _listeners.append(callback)
+
+
+def reload():
+    """読み込み元を読み直して差し替える。内容が変わっていればリスナーに通知する"""
+    with _reload_lock:
+        old, new = _build(reload_module=True)
+    if old is not None and old.version != new.version:
+        for callback in _listeners:
+            try:
+                callback(old, new)
+            except Exception as e:
+                print(f"⚠️ dataset listener failed: {e}")
+    return new
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            changed = os.path.getmtime(source_path()) != _source_mtime
+        except OSError:
+            continue
+        if changed:
+            try:
+                new = reload()
+                print(
+                    f"🔄 station data reloaded: {new.version} ({len(new.stations)} stations)"
+                )
+            except Exception as e:
+                # 書きかけのファイルなどで失敗したら旧データのまま次回に再試行する
+                print(f"⚠️ station data reload failed: {e}")
+
+
+def start_watcher(interval):
+    """読み込み元の更新を監視し、リクエスト処理とは別スレッドで再構築・差し替えを行う"""
+    thread = threading.Thread(target=_watch, args=(interval,), daemon=True)
+    thread.start()
+    return thread
+
+
+def current():
+    """現在有効な Dataset を返す（未構築なら構築する）"""
+    if _current is None:
+        return load()
+    return _current
@@ -0,0 +1,85 @@
+"""駅の空間インデックス（緯度経度の等間隔グリッド）
+
+全駅を線形に走査する代わりに、約1km四方のセルへ駅を振り分けておき、
+半径検索・矩形検索では該当セルの駅だけを距離計算する。
+"""
+
+import math
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEG_LAT = 111.2
+
+# セルの大きさ（度）。東京付近で約 1.1km × 0.9km
+CELL_DEG = 0.01
+
+
+def haversine_km(lat1, lon1, cos_lat1, coord):
+    """ラジアンの地点 (lat1, lon1) と coord = (緯度rad, 経度rad, cos(緯度)) の距離（km）
+
+    cos(緯度) を前計算した座標どうしのハバーサイン距離。駅までの距離は全てこれで測る。
+    """
+    lat2, lon2, cos_lat2 = coord
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + cos_lat1 * cos_lat2 * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """度で与えた2点間の距離（km）"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    return haversine_km(lat1, lng1, math.cos(lat1), (lat2, lng2, math.cos(lat2)))
+
+
+def _cell(lat, lng):
+    return (math.floor(lat / CELL_DEG), math.floor(lng / CELL_DEG))
+
+
+class GeoIndex:
+    def __init__(self, station_list, coords):
+        """coords は Dataset.coords と同じ (緯度rad, 経度rad, cos(緯度)) の列"""
+        self.stations = station_list
+        self.coords = coords
+        self.cells = {}
+        for i, s in enumerate(station_list):
+            self.cells.setdefault(_cell(s["lat"], s["lng"]), []).append(i)
+
+    def _candidates(self, min_lat, min_lng, max_lat, max_lng):
+        i0, j0 = _cell(min_lat, min_lng)
+        i1, j1 = _cell(max_lat, max_lng)
+        # 範囲が登録セル数より広いときはセルを総当たりしない
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            for (ci, cj), members in self.cells.items():
+                if i0 <= ci <= i1 and j0 <= cj <= j1:
+                    yield from members
+            return
+        for ci in range(i0, i1 + 1):
+            for cj in range(j0, j1 + 1):
+                yield from self.cells.get((ci, cj), ())
+
+    def within_radius(self, lat, lng, radius_km, k=None):
+        """半径 radius_km 以内の駅を近い順に返す: [(距離km, 駅インデックス), ...]"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        cos_lat = math.cos(math.radians(lat))
+        dlng = radius_km / (KM_PER_DEG_LAT * max(cos_lat, 1e-6))
+
+        lat1, lon1 = math.radians(lat), math.radians(lng)
+        hits = []
+        for i in self._candidates(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+            d = haversine_km(lat1, lon1, cos_lat, self.coords[i])
+            if d <= radius_km:
+                hits.append((d, i))
+        hits.sort()
+        return hits[:k] if k else hits
+
+    def within_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        """矩形内の駅インデックスを駅データの並び順で返す"""
+        hits = [
+            i
+            for i in self._candidates(min_lat, min_lng, max_lat, max_lng)
+            if min_lat <= self.stations[i]["lat"] <= max_lat
+            and min_lng <= self.stations[i]["lng"] <= max_lng
+        ]
+        hits.sort()
+        return hits
@@ -0,0 +1,83 @@
+"""本番用 gunicorn 設定
+
+起動方法（backend ディレクトリで）:
+    gunicorn -c gunicorn.conf.py main:app
+
+- preload_app: 駅データ・インデックスをマスターで1回だけ構築し、fork 後は
+  コピーオンライトで全ワーカーが同じメモリページを共有する
+- ワーカー数/スレッド数: CPU コア数と Gemini 呼び出しの I/O 待ち時間から自動調整
+- 駅データが更新されたら各ワーカーが再起動せずに読み直して差し替える
+  （dataset.start_watcher）。手動の SIGHUP ではワーカーを順次入れ替える
+"""
+
+import gc
+import math
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+preload_app = True
+worker_class = "gthread"
+
+_cores = multiprocessing.cpu_count()
+
+# CPU を使う処理（距離計算・JSON化）は GIL があるのでプロセスで並列化する
+workers = int(os.environ.get("WEB_CONCURRENCY", max(2, _cores)))
+
+# Gemini 呼び出しはほぼ I/O 待ち。1リクエストあたりの「待ち時間 / CPU時間」の比だけ
+# スレッドを用意すればコアを遊ばせずに済む（ワーカー数で割り、上限32で頭打ち）
+GEMINI_LATENCY_S = float(os.environ.get("GEMINI_LATENCY_S", 3.0))
+CPU_MS_PER_REQUEST = float(os.environ.get("CPU_MS_PER_REQUEST", 20))
+threads = int(
+    os.environ.get(
+        "GUNICORN_THREADS",
+        min(
+            32,
+            max(4, math.ceil(GEMINI_LATENCY_S * 1000 / CPU_MS_PER_REQUEST / workers)),
+        ),
+    )
+)
+
+# Gemini の応答待ちで切られないよう長めに取る
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    server.log.info(f"🚀 workers={workers} threads={threads} cores={_cores}")
+
+
+def post_worker_init(worker):
+    # 駅データは各ワーカーがプロセスを再起動せずに読み直して差し替える
+    # （ウォームなキャッシュを捨てずに済む）。監視スレッドは fork 後に起動する
+    import dataset
+    import main
+
+    if main.STATION_WATCH_INTERVAL > 0:
+        dataset.start_watcher(main.STATION_WATCH_INTERVAL)
+    # 運行情報のポーラーもワーカーごとに起動する（条件付きリクエストなので軽い）
+    if main.odpt_polling_enabled():
+        main.odpt_poller.start()
+
+    # kill -USR2 <ワーカーの pid> で CPU プロファイルを取る（マスターの USR2 は
+    # gunicorn のバイナリ更新なので、ワーカーにだけ送ること）
+    import cpu_profile
+
+    cpu_profile.install_signal_handler()
+
+
+def on_reload(server):
+    # 手動の SIGHUP 時は、マスター側で駅データを作り直してから新ワーカーを fork する
+    import dataset
+
+    dataset.reload()
+    server.log.info(
+        f"✅ station data reloaded ({len(dataset.current().stations)} stations)"
+    )
+
+
+def pre_fork(server, worker):
+    # 構築済みオブジェクトを GC の永続世代へ移し、子プロセスの GC が参照カウント
+    # 領域に書き込んで共有ページをコピーしてしまうのを防ぐ
+    gc.freeze()
@@ -0,0 +1,44 @@
+"""orjson を使う Flask の JSON プロバイダ
+
+Flask 既定の jsonify は標準ライブラリの json で遅く、ensure_ascii=True のため
+日本語の駅名が全て \\uXXXX にエスケープされてバイト数が約3倍になる。
+orjson は高速で、常に UTF-8 のまま出力する（ensure_ascii=False 相当）。
+
+    app.json = OrjsonProvider(app)
+"""
+
+import decimal
+import uuid
+
+import orjson
+from flask.json.provider import JSONProvider
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    # orjson が直接扱えない型は Flask の既定プロバイダと同じく文字列にする
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    """UTF-8 の JSON バイト列を返す（Response にそのまま渡せる）"""
+    return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+
+class OrjsonProvider(JSONProvider):
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
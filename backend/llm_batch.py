@@ -0,0 +1,247 @@
+"""LLM の一括生成ランナー
+
+リクエストの中で1件ずつ generate_content するのではなく、駅データから作った
+入力をまとめて流す。キャッシュの事前投入やデータセット作成に使う。
+
+- 同時実行数を制限した asyncio のワーカープール
+- トークンバケットによる呼び出しレート制限（API クォータ対策）
+- 失敗・スキーマ違反時の指数バックオフ付きリトライ
+- 完了したジョブを JSONL に追記するチェックポイント（途中から再開できる）
+
+使い方（backend ディレクトリで）:
+    python llm_batch.py --checkpoint predictions.jsonl --rps 1 --concurrency 4 --warm-cache
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import llm_output
+import schema
+from json_provider import dumps_bytes
+
+
+class TokenBucket:
+    """rate 回/秒、最大 capacity 回まで溜められるトークンバケット"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    """完了済みジョブの結果を JSONL に追記し、再実行時に読み戻す"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 書き込み途中で止まった最終行は捨てる
+                    self.done[record["id"]] = record["result"]
+
+    def save(self, job_id, result):
+        self.done[job_id] = result
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(
+                    json.dumps({"id": job_id, "result": result}, ensure_ascii=False)
+                )
+                f.write("\n")
+
+
+class Job:
+    def __init__(self, job_id, prompt, output_schema, meta=None):
+        self.id = job_id
+        self.prompt = prompt
+        self.schema = output_schema
+        self.meta = meta or {}
+
+
+async def _run_one(job, generate, bucket, retries, checkpoint):
+    for attempt in range(retries + 1):
+        await bucket.acquire()
+        try:
+            result = json.loads(await generate(job.prompt))
+            errors = schema.validate(result, job.schema)
+            if not errors:
+                checkpoint.save(job.id, result)
+                return result
+            print(f"⚠️ {job.id}: schema errors {errors[:3]}")
+        except Exception as e:
+            print(f"⚠️ {job.id}: attempt {attempt + 1} failed: {e}")
+        # 指数バックオフ + ジッター
+        await asyncio.sleep(min(30.0, 2**attempt) * (0.5 + random.random()))
+    return None
+
+
+async def run_jobs(jobs, generate, concurrency=4, rps=1.0, retries=3, checkpoint=None):
+    """ジョブを並列実行し {job_id: 結果 dict} を返す（失敗したジョブは含まない）
+
+    generate は prompt を受け取り応答テキストを返す async 関数。
+    チェックポイントに結果があるジョブは呼び出さずに再利用する。
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    bucket = TokenBucket(rps)
+    queue = asyncio.Queue()
+    for job in jobs:
+        if job.id not in checkpoint.done:
+            queue.put_nowait(job)
+    pending = queue.qsize()
+    print(f"🚚 {pending} jobs to run ({len(checkpoint.done)} already checkpointed)")
+
+    finished = 0
+
+    async def worker():
+        nonlocal finished
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await _run_one(job, generate, bucket, retries, checkpoint)
+            finished += 1
+            if finished % 50 == 0 or finished == pending:
+                print(f"[batch] {finished}/{pending}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return {
+        job.id: checkpoint.done[job.id] for job in jobs if job.id in checkpoint.done
+    }
+
+
+def gemini_generate(model, genai):
+    """Gemini の非同期 API を使う generate 関数を作る"""
+
+    async def generate(prompt):
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                response_mime_type="application/json"
+            ),
+        )
+        return response.text
+
+    return generate
+
+
+def prediction_jobs(app_main, limit=None):
+    """全ての（最寄り駅, 目的駅）ペアについて /api/gpt-prediction と同じ入力を作る
+
+    ユーザーが出発駅に立っている想定で、現在地には出発駅の座標を使う。
+    所要時間（学習値・混雑度・遅延の補正込み）とプロンプトは本番と同じ
+    prepare_prediction で作るので、キャッシュキーが本番のリクエストと一致する。
+    """
+    ds = app_main.dataset.current()
+    physical = {}
+    for s in ds.stations:
+        physical.setdefault(s["name"], s)
+
+    jobs = []
+    for origin in physical.values():
+        for destination in physical.values():
+            if origin is destination:
+                continue
+            nearest_name, _, minutes, prompt = app_main.prepare_prediction(
+                origin["lat"],
+                origin["lng"],
+                destination["name"],
+                destination["lat"],
+                destination["lng"],
+                destination.get("line_id"),
+            )
+            cache_key = app_main.prediction_cache_key(
+                destination["name"], nearest_name, minutes
+            )
+            jobs.append(
+                Job(
+                    cache_key,
+                    prompt,
+                    schema.PREDICTION_SCHEMA,
+                    {
+                        "cache_key": cache_key,
+                        "estimated_minutes": minutes,
+                        "fallback": app_main.fallback_prediction(
+                            destination["name"], minutes
+                        ),
+                    },
+                )
+            )
+            if limit and len(jobs) >= limit:
+                return jobs
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM 予測の一括生成")
+    parser.add_argument("--checkpoint", default="predictions.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rps", type=float, default=1.0)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=None, help="ジョブ数の上限")
+    parser.add_argument(
+        "--warm-cache", action="store_true", help="結果を共有キャッシュに投入する"
+    )
+    args = parser.parse_args()
+
+    import main as app_main  # Gemini 設定・プロンプトを共有する
+
+    jobs = prediction_jobs(app_main, args.limit)
+    results = asyncio.run(
+        run_jobs(
+            jobs,
+            gemini_generate(app_main.model, app_main.genai),
+            concurrency=args.concurrency,
+            rps=args.rps,
+            retries=args.retries,
+            checkpoint=Checkpoint(args.checkpoint),
+        )
+    )
+    print(f"✅ {len(results)}/{len(jobs)} jobs succeeded")
+
+    if args.warm_cache:
+        # 本番と同じく修復・所要時間の丸めを通してからキャッシュに入れる
+        warmed = 0
+        for job in jobs:
+            if job.id not in results:
+                continue
+            payload = llm_output.repair_prediction(
+                json.dumps(results[job.id], ensure_ascii=False),
+                job.meta["estimated_minutes"],
+                job.meta["fallback"],
+            )
+            if payload is None:
+                print(f"⚠️ {job.id}: unrepairable result, not cached")
+                continue
+            app_main.cache.set(
+                job.meta["cache_key"], dumps_bytes(payload), app_main.GPT_CACHE_TTL
+            )
+            warmed += 1
+        print(f"🔥 warmed {warmed} cache entries")
+
+
+if __name__ == "__main__":
+    main()
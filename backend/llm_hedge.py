@@ -0,0 +1,197 @@
+"""締め切り付き・ヘッジ付きの LLM 呼び出し
+
+generate_content にはタイムアウトがなく、Gemini が詰まるとリクエストも
+ワーカーも止まってしまう。ここでは呼び出しを別スレッドで実行し、
+
+- 最近のレイテンシの指定パーセンタイルを過ぎても返らなければ2本目（ヘッジ）を
+  投げ、先に返った方を採用する
+- 締め切りを過ぎたら TimeoutError を投げる（呼び出し側でフォールバックを返す）
+
+admission（rate_limit.AdmissionControl）を渡すと、1本目もヘッジも呼び出しごとに
+枠を1つ取り、その呼び出しが実際に終わるまで持ち続ける。締め切りで諦めた呼び出しも
+裏では走り続けるので、こうしないと同時実行数の上限が実際の LLM 呼び出し数を抑えない。
+1本目の枠が取れなければ Overloaded を投げ、ヘッジの枠が取れなければヘッジしない。
+
+ヘッジ率・ヘッジ勝率・レイテンシ分布を stats() で返す。
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Overloaded(Exception):
+    """同時実行数が上限で呼び出しを始められなかった"""
+
+
+class LatencyTracker:
+    """直近 window 件のレイテンシ（秒）からパーセンタイルを求める"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class HedgedCaller:
+    """call(*args, **kwargs) をヘッジ・締め切り付きで実行する"""
+
+    def __init__(
+        self,
+        call,
+        deadline_s=8.0,
+        hedge_percentile=90,
+        default_hedge_delay_s=3.0,
+        min_samples=20,
+        max_workers=16,
+        admission=None,
+    ):
+        self.call = call
+        self.deadline_s = deadline_s
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay_s = default_hedge_delay_s
+        self.min_samples = min_samples
+        self.admission = admission
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._attempt_latency = LatencyTracker()
+        self._request_latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._counts = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "overloaded": 0,
+            "hedges_skipped": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def hedge_delay(self):
+        """ヘッジを投げるまでの待ち時間（サンプルが少ないうちは既定値）"""
+        if len(self._attempt_latency) < self.min_samples:
+            return self.default_hedge_delay_s
+        return self._attempt_latency.percentile(self.hedge_percentile)
+
+    def _submit(self, args, kwargs):
+        """呼び出しを1本投げる。同時実行数の枠が取れなければ None"""
+        slot = None
+        if self.admission is not None:
+            slot = self.admission.try_acquire()
+            if slot is None:
+                return None
+        started = time.monotonic()
+        future = self._pool.submit(self.call, *args, **kwargs)
+
+        def finished(f):
+            # 締め切り後に終わった呼び出しもここで枠を返す
+            if slot is not None:
+                self.admission.release(slot)
+            if not f.cancelled() and f.exception() is None:
+                self._attempt_latency.record(time.monotonic() - started)
+
+        future.add_done_callback(finished)
+        return future
+
+    def __call__(self, *args, **kwargs):
+        self._count("calls")
+        started = time.monotonic()
+        deadline = started + self.deadline_s
+        try:
+            return self._run(args, kwargs, deadline)
+        finally:
+            self._request_latency.record(time.monotonic() - started)
+
+    def _run(self, args, kwargs, deadline):
+        primary = self._submit(args, kwargs)
+        if primary is None:
+            self._count("overloaded")
+            raise Overloaded("no free LLM slot")
+        pending = {primary}
+        hedge = None
+        hedge_skipped = False
+        last_error = None
+
+        hedge_at = time.monotonic() + self.hedge_delay()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                self._count("timeouts")
+                # まだ始まっていない呼び出しは取り消す（始まったものは終わるまで枠を持つ）
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError(f"LLM call exceeded {self.deadline_s:.1f}s deadline")
+
+            # ヘッジ前はヘッジ時刻まで、ヘッジ後（または見送り後）は締め切りまで待つ
+            if hedge is not None or hedge_skipped:
+                wait_until = deadline
+            else:
+                wait_until = min(hedge_at, deadline)
+            done, pending = wait(
+                pending, timeout=max(0, wait_until - now), return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                last_error = future.exception()
+                self._count("errors")
+
+            # 1本目が失敗した、またはヘッジ時刻を過ぎた場合は2本目を投げる
+            # （枠が空いていなければ見送って、1本目を締め切りまで待つ）
+            if (
+                hedge is None
+                and not hedge_skipped
+                and (not pending or time.monotonic() >= hedge_at)
+            ):
+                hedge = self._submit(args, kwargs)
+                if hedge is None:
+                    hedge_skipped = True
+                    self._count("hedges_skipped")
+                else:
+                    self._count("hedged")
+                    pending.add(hedge)
+            if not pending:
+                raise last_error
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        calls = counts["calls"] or 1
+        hedged = counts["hedged"] or 1
+
+        def ms(tracker, pct):
+            value = tracker.percentile(pct)
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            **counts,
+            "hedge_rate": round(counts["hedged"] / calls, 3),
+            "hedge_win_rate": round(counts["hedge_wins"] / hedged, 3),
+            "timeout_rate": round(counts["timeouts"] / calls, 3),
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "attempt_latency_ms": {
+                f"p{p}": ms(self._attempt_latency, p) for p in (50, 90, 99)
+            },
+            "request_latency_ms": {
+                f"p{p}": ms(self._request_latency, p) for p in (50, 90, 99)
+            },
+        }
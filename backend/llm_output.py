@@ -0,0 +1,108 @@
+"""LLM 出力（予測 JSON）の検証と修復
+
+Gemini の response.text をそのままブラウザへ返すと、壊れた JSON や巨大な
+出力でクライアント側の再リクエストが発生する。サーバー側で orjson により
+パースし、よくある崩れ（コードフェンス、前後の説明文、末尾カンマ、
+"15分" のような文字列の分数など）をその場で直してからスキーマ検証する。
+minutes はローカルで計算した推定所要時間の範囲に収める。
+"""
+
+import re
+
+import orjson
+
+import schema
+
+# これより大きい出力は異常とみなして修復を試みない
+MAX_OUTPUT_BYTES = 16 * 1024
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_DIGITS = re.compile(r"\d+")
+
+_LIMITS = schema.PREDICTION_SCHEMA["properties"]
+
+
+def _loads_lenient(text):
+    """そのままパースし、失敗したら典型的な崩れを直して再パースする"""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+
+    repaired = _FENCE.sub("", text)
+    start, end = repaired.find("{"), repaired.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    repaired = _TRAILING_COMMA.sub(r"\1", repaired[start : end + 1])
+    repaired = repaired.replace("“", '"').replace("”", '"')
+    try:
+        return orjson.loads(repaired)
+    except orjson.JSONDecodeError:
+        return None
+
+
+def _clip(text, limits):
+    return text.strip()[: limits["maxLength"]]
+
+
+def _coerce_minutes(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(round(value))
+    if isinstance(value, str):
+        match = _DIGITS.search(value)
+        return int(match.group()) if match else None
+    return None
+
+
+def repair_prediction(text, estimated_minutes, fallback):
+    """LLM の出力テキストを検証済みの予測 dict にする。直せなければ None
+
+    欠けた項目は fallback（ローカルで作った予測）で補う。minutes は
+    推定所要時間の半分〜推定所要時間の範囲に丸める（プロンプトでも
+    「より短いルートを見つけた場合のみ短くしてよい」と指示している）。
+    """
+    if not text or len(text) > MAX_OUTPUT_BYTES:
+        return None
+    data = _loads_lenient(text)
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict):
+        return None
+
+    minutes = _coerce_minutes(data.get("minutes"))
+    if minutes is None:
+        minutes = estimated_minutes
+    minutes = min(estimated_minutes, max(max(1, estimated_minutes // 2), minutes))
+
+    steps = data.get("steps")
+    if isinstance(steps, str):
+        steps = [steps]
+    if isinstance(steps, list):
+        steps = [
+            _clip(step, _LIMITS["steps"]["items"])
+            for step in steps
+            if isinstance(step, str) and step.strip()
+        ][: _LIMITS["steps"]["maxItems"]]
+    if not isinstance(steps, list) or not steps:
+        steps = fallback["steps"]
+
+    toilet_info = data.get("toilet_info")
+    if not isinstance(toilet_info, str):
+        toilet_info = ""
+    message = data.get("message")
+    if not isinstance(message, str):
+        message = ""
+
+    payload = {
+        "minutes": minutes,
+        "steps": steps,
+        "toilet_info": _clip(toilet_info, _LIMITS["toilet_info"])
+        or fallback["toilet_info"],
+        "message": _clip(message, _LIMITS["message"]) or fallback["message"],
+    }
+    if schema.validate(payload, schema.PREDICTION_SCHEMA):
+        return None
+    return payload
@@ -1,20 +1,154 @@
 import os
+import gzip
+import orjson
 import requests  # 外部API取得用に追加
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, abort, jsonify, request, send_from_directory
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import google.generativeai as genai
-import stations
+import task_queue
+import station_search
+import cassette
+import compression
+import congestion_index
+import cpu_profile
+import dataset
+import geo_index
+import llm_hedge
+import llm_output
+import mem_profile
+import odpt_live
+import prediction_bundle
+import rate_limit
+import regions
+import trip_log
+import versioning
+import wire
+from json_provider import OrjsonProvider, dumps_bytes
+from shared_cache import cache, escape_like
 import math
 from datetime import datetime
 
 app = Flask(__name__, static_folder="../frontend/build", static_url_path="/")
 CORS(app)
+# 前段のリバースプロキシ（ngrok など）の段数。その段数分だけ X-Forwarded-For を信用して
+# request.remote_addr を実際の接続元にする。0（既定）ならヘッダーは無視する
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+# jsonify を orjson（UTF-8 のまま出力）に差し替える
+app.json = OrjsonProvider(app)
+# Accept-Encoding に応じて動的レスポンスを圧縮する
+compression.init_app(app)
+# MEMORY_PROFILE=1 のときだけリクエストごとのメモリ割り当てを抜き取りで計測する
+mem_profile.init_app(app)
+
+# 駅データとインデックスはインポート時に構築する
+# （gunicorn の preload_app ではマスターで1回だけ構築され、fork 後の各ワーカーで共有される）
+dataset.load()
+
+# 駅データ更新の監視間隔（秒）。0 で無効
+STATION_WATCH_INTERVAL = float(os.environ.get("STATION_WATCH_INTERVAL", 5))
+
+
+def invalidate_station_caches(old, new):
+    """駅データの差し替え時、変更された駅に関わる予測キャッシュだけを消す"""
+    added, changed, removed = versioning.diff(old.stations, new.stations)
+    old_by_id = {s["id"]: s for s in old.stations}
+    names = {s["name"] for s in added + changed}
+    names |= {old_by_id[sid]["name"] for sid in removed}
+    names |= {old_by_id[s["id"]]["name"] for s in changed}
+
+    deleted = 0
+    for name in names:
+        escaped = escape_like(name)
+        # キーは gpt:{目的駅}:{最寄り駅}:{分}。目的駅・最寄り駅のどちらでも該当すれば消す
+        deleted += cache.delete_like(f"gpt:{escaped}:%")
+        deleted += cache.delete_like(f"gpt:%:{escaped}:%")
+    print(
+        f"🧹 invalidated {deleted} prediction cache entries for {len(names)} stations"
+    )
+
+
+dataset.add_listener(invalidate_station_caches)
 
 # --- 設定 ---
 ODPT_API_KEY = os.environ.get("ODPT_API_KEY")
 genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 model = genai.GenerativeModel("models/gemini-flash-latest")
 
+# 上流とのやり取りの記録・再生（オフラインでの負荷試験・再現用）
+# CASSETTE_RECORD: ODPT と Gemini の往復を所要時間付きで追記する JSONL
+# LLM_REPLAY: Gemini を呼ばず、記録した応答を記録時の遅延 × 倍率で返す
+CASSETTE_RECORD = os.environ.get("CASSETTE_RECORD")
+LLM_REPLAY = os.environ.get("LLM_REPLAY")
+odpt_session = requests.Session()
+generate_content = model.generate_content
+if LLM_REPLAY:
+    generate_content = cassette.LlmReplay(
+        LLM_REPLAY, float(os.environ.get("LLM_REPLAY_LATENCY_SCALE", 1.0))
+    )
+    print(f"📼 replaying Gemini responses from {LLM_REPLAY}")
+recorder = cassette.Cassette(CASSETTE_RECORD) if CASSETTE_RECORD else None
+if recorder is not None:
+    cassette.record_session(odpt_session, recorder)
+    generate_content = cassette.record_llm(generate_content, recorder)
+    print(f"🔴 recording upstream calls to {CASSETTE_RECORD}")
+
+# Gemini 呼び出しの締め切り（秒）
+GEMINI_DEADLINE_S = float(os.environ.get("GEMINI_DEADLINE_S", 8))
+
+# /api/gpt-prediction の LLM 呼び出し制限
+# 接続元 IP ごと: GPT_IP_RATE_PER_MIN 回/分（最大 GPT_IP_BURST 回まで連続可）
+# さらにセッションごと: GPT_RATE_PER_MIN 回/分（最大 GPT_BURST 回）。セッション ID は
+# クライアントが自由に変えられるので、IP のバケットの内側の絞り込みにだけ使う
+# ホスト全体: 同時 GPT_MAX_INFLIGHT 件まで。超えた分は待たせずにローカル予測を返す
+gpt_ip_limiter = rate_limit.TokenBucketLimiter(
+    rate_per_s=float(os.environ.get("GPT_IP_RATE_PER_MIN", 30)) / 60,
+    burst=float(os.environ.get("GPT_IP_BURST", 10)),
+)
+gpt_limiter = rate_limit.TokenBucketLimiter(
+    rate_per_s=float(os.environ.get("GPT_RATE_PER_MIN", 6)) / 60,
+    burst=float(os.environ.get("GPT_BURST", 3)),
+)
+gpt_admission = rate_limit.AdmissionControl(
+    max_inflight=int(os.environ.get("GPT_MAX_INFLIGHT", 8))
+)
+# Gemini 呼び出しのヘッジ（遅い呼び出しに2本目を投げて先着を採用）。
+# 1本目もヘッジも gpt_admission の枠を1つずつ取り、呼び出しが終わるまで持つ
+# （締め切り後も走り続ける呼び出しを含めて、実際の同時呼び出し数を抑える）
+hedged_generate = llm_hedge.HedgedCaller(
+    generate_content,
+    deadline_s=GEMINI_DEADLINE_S,
+    hedge_percentile=float(os.environ.get("GEMINI_HEDGE_PERCENTILE", 90)),
+    admission=gpt_admission,
+)
+
+# 路線を開いたときに、現在地に近い PREFETCH_STATIONS 駅の予測を裏で作っておく（0 で無効）
+# 接続元 IP ごとの予算: 先読みの LLM 呼び出しは PREFETCH_PER_HOUR 回/時（最大 PREFETCH_BURST 回）。
+# さらに1回ごとに gpt_ip_limiter の同じ IP のバケットも使う（先読みで上限を超えない）
+PREFETCH_STATIONS = int(os.environ.get("PREFETCH_STATIONS", 3))
+prefetch_limiter = rate_limit.TokenBucketLimiter(
+    rate_per_s=float(os.environ.get("PREFETCH_PER_HOUR", 12)) / 3600,
+    burst=float(os.environ.get("PREFETCH_BURST", 6)),
+)
+# 先読みの LLM 呼び出しは gpt_admission を使わず、ホスト全体で同時 PREFETCH_MAX_INFLIGHT 件
+# までの別枠で行う（利用者の /api/gpt-prediction の枠を先読みで減らさない）
+prefetch_admission = rate_limit.AdmissionControl(
+    max_inflight=int(os.environ.get("PREFETCH_MAX_INFLIGHT", 2)),
+    directory=os.path.join(rate_limit.DEFAULT_SLOT_DIR, "prefetch"),
+)
+prefetch_generate = llm_hedge.HedgedCaller(
+    generate_content,
+    deadline_s=GEMINI_DEADLINE_S,
+    hedge_percentile=float(os.environ.get("GEMINI_HEDGE_PERCENTILE", 90)),
+    max_workers=4,
+    admission=prefetch_admission,
+)
+
+# /api/debug/* を使うための管理トークン（未設定ならデバッグ API は無効）
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
 # フロントエンドのIDとODPTの正式な路線識別子(URN)の紐付け
 LINE_MAP = {
     "yamanote": "odpt.Line:JR-East.Yamanote",
@@ -25,20 +159,79 @@ LINE_MAP = {
     "hanzomon": "odpt.Line:TokyoMetro.Hanzomon",
 }
 
+# 地域ごとの駅データのパーティション。東京（stations.py と LINE_MAP）が既定で、
+# 他の地域は REGIONS_PATH の設定から初回アクセス時に読み込む
+TOKYO_BBOX = (34.8, 138.4, 36.5, 140.9)
+REGIONS = regions.Registry(
+    regions.Region("tokyo", TOKYO_BBOX, line_map=LINE_MAP),
+    os.environ.get("REGIONS_PATH"),
+)
+
+
+def request_region():
+    """?region= のパーティション（未指定なら既定）。未登録なら 404"""
+    region = REGIONS.get(request.args.get("region"))
+    if region is None:
+        abort(404)
+    return region
+
+
+# ODPT API の接続先（replay_server.py に向ければ記録済みレスポンスで動く）
+ODPT_BASE_URL = os.environ.get("ODPT_BASE_URL", "https://api.odpt.org/api/v4")
+
+# 運行情報・列車位置の取得間隔（秒）。0 で無効。API キーが無く接続先も既定なら取得しない
+ODPT_POLL_INTERVAL = float(os.environ.get("ODPT_POLL_INTERVAL", 60))
+odpt_poller = odpt_live.LivePoller(
+    ODPT_BASE_URL, ODPT_API_KEY, REGIONS.all_lines(), interval=ODPT_POLL_INTERVAL
+)
+if recorder is not None:
+    cassette.record_session(odpt_poller.session, recorder)
+
+
+def odpt_polling_enabled():
+    return ODPT_POLL_INTERVAL > 0 and (ODPT_API_KEY or "ODPT_BASE_URL" in os.environ)
+
+
+# 共有キャッシュの有効期限（秒）
+ODPT_CACHE_TTL = int(os.environ.get("ODPT_CACHE_TTL", 24 * 60 * 60))
+GPT_CACHE_TTL = int(os.environ.get("GPT_CACHE_TTL", 60 * 60))
+# この秒数を過ぎた ODPT 路線データは、キャッシュから返しつつ裏で取り直す
+ODPT_REFRESH_AFTER = int(os.environ.get("ODPT_REFRESH_AFTER", 6 * 60 * 60))
+# 差分同期のために ODPT 路線データの過去バージョンを残す期間
+ODPT_SNAPSHOT_TTL = int(os.environ.get("ODPT_SNAPSHOT_TTL", 7 * 24 * 60 * 60))
+
+# ODPT の再取得・実測ログの書き込みを行うプロセス内のタスクキュー
+tasks = task_queue.TaskQueue(
+    workers=int(os.environ.get("TASK_WORKERS", 4)),
+    max_depth=int(os.environ.get("TASK_MAX_DEPTH", 1000)),
+)
+# 予測の先読み専用のキュー。LLM の応答待ちで ODPT の再取得・実測の書き込みを待たせない
+prefetch_tasks = task_queue.TaskQueue(
+    workers=int(os.environ.get("PREFETCH_WORKERS", 1)),
+    max_depth=int(os.environ.get("PREFETCH_MAX_DEPTH", 100)),
+    name="prefetch",
+)
+
+# タスクキューが満杯で実測を受け付けられないときに再送を促す秒数
+TRIPS_RETRY_AFTER_S = 30
+
+# /api/trips の接続元 IP ごとの制限: TRIPS_PER_HOUR 回/時（最大 TRIPS_BURST 回まで連続可）
+# 1人が同じ駅ペアの値を何度も送って、全員の所要時間の推定を動かせないようにする
+trips_limiter = rate_limit.TokenBucketLimiter(
+    rate_per_s=float(os.environ.get("TRIPS_PER_HOUR", 12)) / 3600,
+    burst=float(os.environ.get("TRIPS_BURST", 4)),
+)
+
+# 利用者が同意して送った実測の乗車時間（駅ペアごとに学習して所要時間の推定に使う）
+trips = trip_log.TripStore(
+    os.environ.get("TRIP_LOG_DIR", os.path.join(os.path.dirname(__file__), "trip_logs"))
+)
+
 
 # GPS座標間の距離を計算（ハバーサイン公式）
 def calculate_distance_km(lat1, lon1, lat2, lon2):
     """緯度経度からキロメートル単位の距離を計算"""
-    R = 6371  # 地球半径（km）
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    )
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
+    return geo_index.distance_km(lat1, lon1, lat2, lon2)
 
 
 def estimate_travel_minutes(distance_km):
@@ -49,34 +242,19 @@ def estimate_travel_minutes(distance_km):
 
 
 def find_nearest_station(user_lat, user_lng, exclude_station_name=None):
-    """ユーザーの現在地から最寄り駅を探索"""
-    min_distance = float("inf")
-    nearest_station = None
-
-    for station in stations.STATIONS:
-        if exclude_station_name and station["name"] == exclude_station_name:
-            continue
-
-        distance = calculate_distance_km(
-            float(user_lat), float(user_lng), station["lat"], station["lng"]
-        )
-
-        if distance < min_distance:
-            min_distance = distance
-            nearest_station = station
-
-    return nearest_station
+    """ユーザーの現在地から最寄り駅を探索（現在地を含む地域のデータだけを見る）"""
+    ds = REGIONS.for_point(float(user_lat), float(user_lng)).dataset()
+    model = ds.model
+    # 除外は駅名の文字列比較ではなく物理駅 id で行う（同名の別路線レコードも除外される）
+    exclude_id = model.id_of(exclude_station_name) if exclude_station_name else None
+    station_id = model.nearest(float(user_lat), float(user_lng), exclude_id=exclude_id)
+    if station_id is None:
+        return None
+    return ds.stations[model.first_record[station_id]]
 
 
 # 時間帯ごとの混雑度パターン（0-10段階、10が最も混雑）
-CONGESTION_PATTERN = {
-    (7, 9): 8,  # 朝ラッシュ: 非常に混雑
-    (9, 11): 6,  # 朝から昼: やや混雑
-    (11, 14): 3,  # 昼間: 空いている
-    (14, 16): 4,  # 午後: 少し混雑
-    (16, 19): 7,  # 夕方ラッシュ: 混雑
-    (19, 21): 5,  # 夜間: やや混雑
-}
+CONGESTION_PATTERN = congestion_index.CONGESTION_PATTERN
 
 
 def get_congestion_level():
@@ -89,7 +267,7 @@ def get_congestion_level():
             return level, hour
 
     # 上記以外の時間（21-7時）は空いている
-    return 2, hour
+    return congestion_index.OFF_PEAK_LEVEL, hour
 
 
 def get_congestion_info():
@@ -131,88 +309,397 @@ def serve_static(path):
 
 @app.route("/api/lines")
 def lines():
-    return jsonify(stations.ALL_LINES)
+    return jsonify(request_region().dataset().lines)
 
 
 @app.route("/api/stations")
 def get_stations():
+    region = request_region()
     raw_line_id = request.args.get("line_id")
+    fmt = wire.negotiate(request.headers.get("Accept"), request.args.get("format"))
     if not raw_line_id:
-        return jsonify(stations.STATIONS)
+        return _encoded_stations(region.dataset(), fmt)
 
     line_id = raw_line_id.strip().replace('"', "").replace("'", "").lower()
 
-    if line_id in LINE_MAP and ODPT_API_KEY:
-        url = "https://api.odpt.org/api/v4/odpt:Station"
-        params = {"odpt:line": LINE_MAP[line_id], "acl:consumerKey": ODPT_API_KEY}
-
-        # タイムアウトと簡易リトライ設定
-        timeout_seconds = 10
-        max_attempts = 2
-        for attempt in range(1, max_attempts + 1):
-            try:
-                response = requests.get(url, params=params, timeout=timeout_seconds)
-                response.raise_for_status()
-                api_data = response.json()
-
-                if api_data:
-                    formatted_stations = []
-                    for s in api_data:
-                        formatted_stations.append(
-                            {
-                                "id": s.get("owl:sameAs"),
-                                "name": s.get("dc:title", "不明な駅"),
-                                "line_id": line_id,
-                                "lat": s.get("geo:lat"),
-                                "lng": s.get("geo:long"),
-                            }
-                        )
-                    formatted_stations.sort(key=lambda x: x["name"])
-                    return jsonify(formatted_stations)
-
-                # 空レスポンスならリトライの対象にする
-                if attempt < max_attempts:
-                    continue
-                break
-
-            except requests.RequestException as e:
-                print(f"⚠️ ODPT request attempt {attempt} for {line_id} failed: {e}")
-                if attempt < max_attempts:
-                    continue
-                # 最終的に失敗したらローカルデータへフォールバック
-                break
-
-    return jsonify(stations.get_stations_by_line(line_id))
+    if line_id in region.line_map and ODPT_API_KEY:
+        body = fetch_odpt_line(line_id)
+        if body is not None:
+            schedule_prefetch(region, line_id, body)
+            response = Response(body, mimetype="application/json")
+            return _with_version(response, versioning.body_version(body))
 
+    schedule_prefetch(region, line_id)
+    return _encoded_stations(region.dataset(), fmt, line_id)
 
-@app.route("/api/gpt-prediction", methods=["POST"])
-def gpt_prediction():
-    data = request.json
-    lat = data.get("lat")
-    lng = data.get("lng")
-    station_name = data.get("station_name", "目的地")
-    station_lat = data.get("station_lat")
-    station_lng = data.get("station_lng")
 
-    # デバッグログ：受け取ったペイロードを出力
-    print(
-        f"[GPT Prediction] User Location: ({lat}, {lng}), Destination: {station_name} ({station_lat}, {station_lng})"
+def schedule_prefetch(region, line_id, odpt_body=None):
+    """セッション ID と現在地（?lat=&lng=）があれば、その路線の予測の先読みを積む
+
+    odpt_body はクライアントに返した ODPT の駅一覧。あればその駅名（dc:title）で
+    先読みするので、クリック時の予測と同じキャッシュキーになる。
+    重複排除と予算はセッション ID（クライアントが自由に変えられる）ではなく接続元 IP 単位。
+    """
+    if PREFETCH_STATIONS <= 0 or not request.headers.get("X-Session-Id"):
+        return
+    try:
+        lat = _lat_arg("lat")
+        lng = _lng_arg("lng")
+    except ValueError:
+        return
+    ip = client_ip()
+    prefetch_tasks.enqueue(
+        "prefetch",
+        f"prefetch:{ip}:{line_id}",
+        prefetch_predictions,
+        ip,
+        region.name,
+        line_id,
+        lat,
+        lng,
+        odpt_body,
     )
 
-    # 距離と所要時間を計算
-    distance_km = calculate_distance_km(
-        float(lat), float(lng), float(station_lat), float(station_lng)
+
+def _encoded_stations(ds, fmt, line_id=None):
+    """Dataset にキャッシュされたエンコード済みの駅リストを返す"""
+    response = Response(ds.encoded(fmt, line_id), mimetype=wire.MIMETYPES[fmt])
+    response.headers["Vary"] = "Accept"
+    response.headers["X-Data-Version"] = ds.version
+    response.set_etag(f"{ds.version}-{fmt}-{line_id or 'all'}")
+    return response.make_conditional(request)
+
+
+def _with_version(response, version):
+    """バージョンを ETag / X-Data-Version に付け、If-None-Match なら 304 にする"""
+    response.headers["X-Data-Version"] = version
+    response.set_etag(version)
+    return response.make_conditional(request)
+
+
+def fetch_odpt_line(line_id):
+    """共有キャッシュにある ODPT の路線データ (bytes) を返す。無ければ None
+
+    取得はリクエスト処理では行わず、キャッシュが無い・古い場合にタスクキューへ
+    再取得を積むだけにする（None のときは呼び出し側がローカルデータを返す）。
+    """
+    cached = cache.get(f"odpt:{line_id}")
+    if cached is None or cache.get(f"odpt-fresh:{line_id}") is None:
+        tasks.enqueue("odpt", f"odpt:{line_id}", refresh_odpt_line, line_id)
+    return cached
+
+
+def refresh_odpt_line(line_id):
+    """ODPT から路線の駅一覧を取得し、エンコード済み JSON (bytes) を返す。失敗時は None"""
+    cache_key = f"odpt:{line_id}"
+    url = f"{ODPT_BASE_URL}/odpt:Station"
+    params = {"odpt:line": REGIONS.line_urn(line_id), "acl:consumerKey": ODPT_API_KEY}
+
+    # タイムアウトと簡易リトライ設定
+    timeout_seconds = 10
+    max_attempts = 2
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = odpt_session.get(url, params=params, timeout=timeout_seconds)
+            response.raise_for_status()
+            api_data = response.json()
+
+            if api_data:
+                formatted_stations = []
+                for s in api_data:
+                    formatted_stations.append(
+                        {
+                            "id": s.get("owl:sameAs"),
+                            "name": s.get("dc:title", "不明な駅"),
+                            "line_id": line_id,
+                            "lat": s.get("geo:lat"),
+                            "lng": s.get("geo:long"),
+                        }
+                    )
+                formatted_stations.sort(key=lambda x: x["name"])
+                body = dumps_bytes(formatted_stations)
+                cache.set(cache_key, body, ODPT_CACHE_TTL)
+                cache.set(f"odpt-fresh:{line_id}", b"1", ODPT_REFRESH_AFTER)
+                # 差分同期用にこのバージョンのスナップショットも残す
+                version = versioning.body_version(body)
+                cache.set(f"odpt-snap:{line_id}:{version}", body, ODPT_SNAPSHOT_TTL)
+                return body
+
+            # 空レスポンスならリトライの対象にする
+            if attempt < max_attempts:
+                continue
+            break
+
+        except requests.RequestException as e:
+            print(f"⚠️ ODPT request attempt {attempt} for {line_id} failed: {e}")
+            if attempt < max_attempts:
+                continue
+            # 最終的に失敗したら None（呼び出し側でローカルデータへフォールバック）
+            break
+
+    return None
+
+
+@app.route("/api/stations/changes")
+def station_changes():
+    """since= のバージョンから現在までに追加・変更・削除された駅だけを返す
+
+    line_id を指定し ODPT が有効な場合は ODPT 由来の路線データの差分を返す。
+    since が不明（古すぎる・未指定）の場合は full=true で全駅を added に入れて返す。
+    過去バージョンを保持しているのは既定の地域だけなので、他の地域（?region=）は
+    since が現在のバージョンなら空の差分、それ以外は full=true になる。
+    """
+    region = request_region()
+    since = request.args.get("since", "")
+    line_id = request.args.get("line_id", "").strip().lower() or None
+
+    if line_id in region.line_map and ODPT_API_KEY:
+        body = fetch_odpt_line(line_id)
+        if body is not None:
+            current_list = orjson.loads(body)
+            version = versioning.body_version(body)
+            old_body = cache.get(f"odpt-snap:{line_id}:{since}") if since else None
+            old_list = orjson.loads(old_body) if old_body is not None else None
+            return _changes_response(since, version, old_list, current_list)
+
+    ds = region.dataset()
+    if not since:
+        old_list = None
+    elif region is REGIONS.default:
+        old_list = dataset.history.get(since)
+    else:
+        old_list = ds.stations if since == ds.version else None
+    current_list = ds.stations
+    if line_id:
+        current_list = [s for s in current_list if s["line_id"] == line_id]
+        if old_list is not None:
+            old_list = [s for s in old_list if s["line_id"] == line_id]
+    return _changes_response(since, ds.version, old_list, current_list)
+
+
+def _changes_response(since, version, old_list, current_list):
+    if old_list is None:
+        added, changed, removed = current_list, [], []
+    else:
+        added, changed, removed = versioning.diff(old_list, current_list)
+    return jsonify(
+        {
+            "version": version,
+            "since": since,
+            "full": old_list is None,
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+        }
     )
-    estimated_minutes = estimate_travel_minutes(distance_km)
 
-    # 現在地から最寄り駅を検索
-    nearest_station = find_nearest_station(lat, lng, exclude_station_name=station_name)
-    nearest_station_name = nearest_station["name"] if nearest_station else "最寄り駅"
 
-    print(f"[Distance] {distance_km:.2f}km, Estimated: {estimated_minutes}min")
-    print(f"[Nearest Station] {nearest_station_name}")
+# 近傍・矩形検索の上限値
+NEAR_MAX_RADIUS_KM = 50
+PAGE_MAX_LIMIT = 200
+COMPACT_FIELDS = ["id", "name", "line_id", "lat", "lng"]
+
+
+def _float_arg(name, default=None, low=None, high=None):
+    """クエリの数値を読む。nan / inf と [low, high] の範囲外は ValueError"""
+    value = request.args.get(name)
+    if value is None or value == "":
+        if default is None:
+            raise ValueError(f"{name} is required")
+        return default
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be finite")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def _lat_arg(name):
+    return _float_arg(name, low=-90, high=90)
+
+
+def _lng_arg(name):
+    return _float_arg(name, low=-180, high=180)
+
+
+def _page_args():
+    offset = max(0, int(request.args.get("offset", 0)))
+    limit = min(PAGE_MAX_LIMIT, max(1, int(request.args.get("limit", 50))))
+    return offset, limit
+
+
+def _compact_page(rows, fields, offset, limit):
+    """キーを繰り返さない配列形式のページを返す"""
+    page = rows[offset : offset + limit]
+    next_offset = offset + limit if offset + limit < len(rows) else None
+    return jsonify(
+        {
+            "fields": fields,
+            "rows": page,
+            "total": len(rows),
+            "offset": offset,
+            "next_offset": next_offset,
+        }
+    )
+
+
+@app.route("/api/stations/near")
+def stations_near():
+    """現在地から半径 radius_km 以内の駅を近い順に返す"""
+    try:
+        lat = _lat_arg("lat")
+        lng = _lng_arg("lng")
+        radius_km = min(NEAR_MAX_RADIUS_KM, _float_arg("radius_km", 1.0))
+        k = int(request.args.get("k", PAGE_MAX_LIMIT))
+        offset, limit = _page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ds = REGIONS.for_point(lat, lng).dataset()
+    rows = [
+        [*(ds.stations[i][f] for f in COMPACT_FIELDS), round(d, 3)]
+        for d, i in ds.geo_index.within_radius(lat, lng, radius_km, k=max(1, k))
+    ]
+    return _compact_page(rows, COMPACT_FIELDS + ["distance_km"], offset, limit)
+
+
+@app.route("/api/stations/bbox")
+def stations_bbox():
+    """地図の表示範囲（min_lat, min_lng, max_lat, max_lng）内の駅を返す"""
+    try:
+        min_lat = _lat_arg("min_lat")
+        min_lng = _lng_arg("min_lng")
+        max_lat = _lat_arg("max_lat")
+        max_lng = _lng_arg("max_lng")
+        offset, limit = _page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if min_lat > max_lat or min_lng > max_lng:
+        return jsonify({"error": "min must not exceed max"}), 400
+
+    # 表示範囲の中心を含む地域で検索する
+    ds = REGIONS.for_point((min_lat + max_lat) / 2, (min_lng + max_lng) / 2).dataset()
+    rows = [
+        [ds.stations[i][f] for f in COMPACT_FIELDS]
+        for i in ds.geo_index.within_bbox(min_lat, min_lng, max_lat, max_lng)
+    ]
+    return _compact_page(rows, COMPACT_FIELDS, offset, limit)
+
+
+SEARCH_MAX_LIMIT = 50
+
+
+@app.route("/api/stations/search")
+def stations_search():
+    """駅名検索。漢字・かな・ローマ字の前方一致（誤字許容）で、lat/lng があれば近い順"""
+    q = request.args.get("q", "").strip()
+    try:
+        # 現在地は任意（あれば near・bbox と同じく範囲外・nan / inf を 400 にする）
+        lat = _lat_arg("lat") if request.args.get("lat") else None
+        lng = _lng_arg("lng") if request.args.get("lng") else None
+        limit = min(SEARCH_MAX_LIMIT, max(1, int(request.args.get("limit", 10))))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not q:
+        return jsonify({"error": "q is required"}), 400
+
+    if lat is not None and lng is not None:
+        ds = REGIONS.for_point(lat, lng).dataset()
+    else:
+        ds = request_region().dataset()
+    results = []
+    for station_id, quality, distance in ds.search.search(q[:64], lat, lng, limit):
+        s = ds.stations[ds.model.first_record[station_id]]
+        results.append(
+            {
+                "id": s["id"],
+                "name": s["name"],
+                "name_en": s.get("name_en"),
+                "lat": s["lat"],
+                "lng": s["lng"],
+                "line_ids": [
+                    ds.model.line_ids[l] for l in ds.model.lines_of[station_id]
+                ],
+                "match": station_search.MATCH_NAMES[quality],
+                "distance_km": None if distance is None else round(distance, 3),
+            }
+        )
+    return jsonify({"query": q, "results": results})
+
 
-    prompt = f"""あなたはIBS（過敏性腸症候群）で苦しむユーザーを救う、最高峰の駅構内コンシェルジュです。
+TOILETS_MAX_K = 20
+
+
+@app.route("/api/toilets/nearest")
+def toilets_nearest():
+    """現在地から最も早く着けるトイレのある駅を上位 k 件返す（LLM は呼ばない）"""
+    try:
+        lat = _lat_arg("lat")
+        lng = _lng_arg("lng")
+        k = min(TOILETS_MAX_K, max(1, int(request.args.get("k", 5))))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ds = REGIONS.for_point(lat, lng).dataset()
+    congestion = get_congestion_info()
+    results = []
+    levels = ds.congestion.column(congestion["hour"])
+    for station_id, distance, minutes in ds.toilets.rank(lat, lng, k, levels):
+        s = ds.stations[ds.model.first_record[station_id]]
+        results.append(
+            {
+                "id": s["id"],
+                "name": s["name"],
+                "lat": s["lat"],
+                "lng": s["lng"],
+                "line_ids": [
+                    ds.model.line_ids[l] for l in ds.model.lines_of[station_id]
+                ],
+                "distance_km": round(distance, 3),
+                "minutes": math.ceil(minutes),
+                "congestion_level": int(levels[station_id]),
+            }
+        )
+    return jsonify({"congestion": congestion, "results": results})
+
+
+@app.route("/api/prediction-bundle")
+def get_prediction_bundle():
+    """事前計算済みの予測バンドルを gzip のまま配信する（クライアントでキャッシュ可）"""
+    bundle = prediction_bundle.load()
+    if bundle is None:
+        return jsonify({"error": "prediction bundle not built"}), 404
+    # 駅データが更新された・別地域のデータなら、古いバンドルは配らない
+    if bundle.dataset_version != request_region().dataset().version:
+        return jsonify({"error": "prediction bundle is stale"}), 404
+
+    # gzip を選べば作成済みのバイト列をそのまま返す。他の方式（br など）や非圧縮なら
+    # 展開して返し、圧縮は compression の after_request に任せる
+    if compression.negotiate(request.headers.get("Accept-Encoding")) == "gzip":
+        response = Response(bundle.compressed, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(
+            gzip.decompress(bundle.compressed), mimetype="application/json"
+        )
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return _with_version(response, versioning.body_version(bundle.compressed))
+
+
+def build_prediction_prompt(
+    lat,
+    lng,
+    nearest_station_name,
+    station_name,
+    station_lat,
+    station_lng,
+    distance_km,
+    estimated_minutes,
+):
+    """Gemini に渡す予測プロンプトを組み立てる（バッチ処理とも共用）"""
+    return f"""あなたはIBS（過敏性腸症候群）で苦しむユーザーを救う、最高峰の駅構内コンシェルジュです。
 
 【重要な情報】
 ユーザーの現在地（GPS）: 緯度{lat}, 経度{lng}
@@ -238,26 +725,372 @@ def gpt_prediction():
 }}
 """
 
+
+def fallback_prediction(station_name, estimated_minutes):
+    """LLM を使えないときに返すローカルの予測"""
+    return {
+        "minutes": estimated_minutes,
+        "steps": [f"{station_name}へ直行してください"],
+        "toilet_info": "駅到着後、案内図を見て最も近いトイレへ！",
+        "message": "諦めるな！お尻を締めろ！",
+    }
+
+
+def prediction_cache_key(station_name, nearest_station_name, estimated_minutes):
+    """予測結果の共有キャッシュキー（目的駅名を先頭にして駅単位で消せるようにする）"""
+    return f"gpt:{station_name}:{nearest_station_name}:{estimated_minutes}"
+
+
+def client_ip():
+    """接続元 IP（TRUSTED_PROXY_HOPS 段のプロキシを ProxyFix で解決した後の値）
+
+    X-Forwarded-For の左端はクライアントが好きに書けるので使わない。
+    """
+    return request.remote_addr or "unknown"
+
+
+def check_gpt_rate():
+    """IP のバケットと、セッション ID があればそのバケットの両方から1トークン使う
+
+    (許可, 再試行までの秒数) を返す。
+    """
+    allowed, retry_after = gpt_ip_limiter.allow(f"ip:{client_ip()}")
+    session_id = request.headers.get("X-Session-Id")
+    if allowed and session_id:
+        allowed, retry_after = gpt_limiter.allow(f"session:{session_id[:64]}")
+    return allowed, retry_after
+
+
+def require_admin():
+    """管理トークンが一致しなければ 404（デバッグ API の存在自体を隠す）"""
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        abort(404)
+
+
+@app.route("/api/debug/llm")
+def debug_llm():
+    require_admin()
+    return jsonify(
+        {
+            **hedged_generate.stats(),
+            "admitted": gpt_admission.admitted,
+            "shed": gpt_admission.rejected,
+            "prefetch": {
+                **prefetch_generate.stats(),
+                "admitted": prefetch_admission.admitted,
+                "shed": prefetch_admission.rejected,
+            },
+        }
+    )
+
+
+@app.route("/api/debug/compression")
+def debug_compression():
+    require_admin()
+    return jsonify(compression.stats.snapshot())
+
+
+@app.route("/api/debug/memory")
+def debug_memory():
+    """このワーカーのメモリ割り当ての集計。?dump=1 でファイルにも書き出す"""
+    require_admin()
+    result = mem_profile.report()
+    if request.args.get("dump") == "1":
+        result["dump_path"] = mem_profile.dump()
+    return jsonify(result)
+
+
+@app.route("/api/debug/cpu-profile", methods=["GET", "POST"])
+def debug_cpu_profile():
+    """POST でこのワーカーのサンプリングプロファイルを seconds 秒間取る。GET は状態"""
+    require_admin()
+    if request.method == "POST":
+        try:
+            seconds = float(request.args.get("seconds", 30))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if cpu_profile.start(seconds) is None:
+            return jsonify({"error": "already running", **cpu_profile.status()}), 409
+    return jsonify(cpu_profile.status())
+
+
+def trip_estimate_minutes(origin, destination):
+    """実測の検証用: 出発駅の地域で両駅を引き、距離から推定した所要時間（分）
+
+    どちらかの駅がその地域に無ければ None。
+    """
+    region = REGIONS.for_station(origin)
+    if region is None:
+        return None
+    model = region.dataset().model
+    o = model.id_of(origin)
+    d = model.id_of(destination)
+    if o is None or d is None:
+        return None
+    return estimate_travel_minutes(
+        calculate_distance_km(model.lat[o], model.lng[o], model.lat[d], model.lng[d])
+    )
+
+
+@app.route("/api/trips", methods=["POST"])
+def post_trips():
+    """実際の乗車時間を受け取る（利用者の同意がある場合のみ）
+
+    {"consent": true, "trips": [{"origin", "destination", "minutes", "hour"}, ...]}
+    位置・IP・時刻は保存せず、駅名・分・時間帯（時）だけを記録する
+    （IP は送信回数の制限にだけ使い、実測とは結び付けない）。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or data.get("consent") is not True:
+        return jsonify({"error": "consent is required"}), 400
+    if not isinstance(data.get("trips"), list):
+        return jsonify({"error": "trips must be a list"}), 400
+    allowed, retry_after = trips_limiter.allow(f"trips:ip:{client_ip()}")
+    if not allowed:
+        response = jsonify({"error": "too many trip reports"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+        return response
+    valid, rejected = trip_log.validate_trips(data["trips"], trip_estimate_minutes)
+    # ログへの書き込みはタスクキューで行う（ハンドラは積むだけ）。キューが満杯なら
+    # 受け付けたことにせず、後で送り直してもらう
+    if valid and not tasks.enqueue("trips", None, trips.append, valid):
+        response = jsonify({"error": "trip log queue is full"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(TRIPS_RETRY_AFTER_S)
+        return response
+    return jsonify({"accepted": len(valid), "rejected": rejected})
+
+
+@app.route("/api/debug/regions")
+def debug_regions():
+    require_admin()
+    return jsonify(REGIONS.summary())
+
+
+@app.route("/api/debug/tasks")
+def debug_tasks():
+    require_admin()
+    return jsonify({**tasks.stats(), "prefetch": prefetch_tasks.stats()})
+
+
+@app.route("/api/debug/odpt")
+def debug_odpt():
+    require_admin()
+    return jsonify({"stats": odpt_poller.stats, "lines": odpt_poller.snapshot()})
+
+
+def prepare_prediction(lat, lng, station_name, station_lat, station_lng, line_id):
+    """所要時間の推定とプロンプトの組み立て（gpt_prediction と先読みで共通）
+
+    (最寄り駅名, 直線距離 km, 推定所要時間 分, プロンプト) を返す。
+    """
+    # 距離と所要時間を計算
+    distance_km = calculate_distance_km(
+        float(lat), float(lng), float(station_lat), float(station_lng)
+    )
+    estimated_minutes = estimate_travel_minutes(distance_km)
+
+    # 現在地から最寄り駅を検索
+    nearest_station = find_nearest_station(lat, lng, exclude_station_name=station_name)
+    nearest_station_name = nearest_station["name"] if nearest_station else "最寄り駅"
+
+    # 実測が十分に集まっている駅ペアは、固定式の推定より学習値を優先する
+    learned = trips.learned_minutes(
+        nearest_station_name, station_name, datetime.now().hour
+    )
+    if learned is not None:
+        estimated_minutes = max(1, round(learned))
+    elif nearest_station is not None:
+        # 学習値が無ければ、出発駅のこの時間帯の混雑度の分だけ上乗せする（O(1)）
+        ds = REGIONS.for_point(float(lat), float(lng)).dataset()
+        nearest_id = ds.model.id_of(nearest_station_name)
+        if nearest_id is not None:
+            level = ds.congestion.level(nearest_id, datetime.now().hour)
+            estimated_minutes += round(level * congestion_index.MINUTES_PER_LEVEL)
+
+    # 選択中の路線が遅れていれば、その分を上乗せする（ポーラーの状態を O(1) で読む）
+    line_status = odpt_poller.status(line_id)
+    if line_status.delay_minutes:
+        estimated_minutes += line_status.delay_minutes
+
+    prompt = build_prediction_prompt(
+        lat,
+        lng,
+        nearest_station_name,
+        station_name,
+        station_lat,
+        station_lng,
+        distance_km,
+        estimated_minutes,
+    )
+    return nearest_station_name, distance_km, estimated_minutes, prompt
+
+
+def generate_prediction(prompt, estimated_minutes, fallback, caller=hedged_generate):
+    """LLM で予測を生成して修復済みの dict を返す。失敗・締め切り超過なら None
+
+    caller の同時実行数の枠（既定は gpt_admission、先読みは prefetch_admission）が
+    上限で始められなければ llm_hedge.Overloaded を投げる。
+    """
     try:
-        response = model.generate_content(
+        response = caller(
             prompt,
             generation_config=genai.types.GenerationConfig(
                 response_mime_type="application/json"
             ),
+            request_options={"timeout": GEMINI_DEADLINE_S},
         )
-        return response.text
+    except llm_hedge.Overloaded:
+        raise
+    except TimeoutError as e:
+        print(f"⏱️ {e}")
+        return None
     except Exception as e:
         print(f"Gemini Error: {e}")
-        return jsonify(
-            {
-                "minutes": estimated_minutes,
-                "steps": [f"{station_name}へ直行してください"],
-                "toilet_info": "駅到着後、案内図を見て最も近いトイレへ！",
-                "message": "諦めるな！お尻を締めろ！",
-            }
+        return None
+
+    # 壊れた出力はサーバー側で修復し、直せなければ None
+    # （クライアントに再リクエストさせない）
+    payload = llm_output.repair_prediction(response.text, estimated_minutes, fallback)
+    if payload is None:
+        print(f"⚠️ Gemini output rejected: {response.text[:200]!r}")
+    return payload
+
+
+def prefetch_predictions(ip, region_name, line_id, lat, lng, odpt_body=None):
+    """路線上で現在地に近い PREFETCH_STATIONS 駅の予測を先に作って共有キャッシュに入れる
+
+    先読み専用のタスクキュー（prefetch_tasks）のワーカーで動く。駅はクライアントが
+    受け取ったのと同じ一覧（ODPT の本文、無ければ地域の駅データ）から選ぶ。バンドル・
+    キャッシュにある駅は飛ばし、LLM を呼ぶ駅ごとに IP の先読み予算（prefetch_limiter）と
+    LLM の IP 単位の制限（gpt_ip_limiter）を1つずつ使う。LLM は先読み専用の枠
+    （prefetch_admission）で呼ぶので、利用者のリクエストの枠（gpt_admission）は使わない。
+    予算切れや先読みの枠が埋まっているときはそこでやめる。
+    """
+    if odpt_body is not None:
+        records = orjson.loads(odpt_body)
+    else:
+        region = REGIONS.get(region_name)
+        records = region.dataset().by_line.get(line_id, []) if region else []
+    # 同じ駅が路線内に複数レコードあっても1回だけ。座標の無い駅は予測できないので除く
+    candidates = {}
+    for s in records:
+        if s.get("lat") is None or s.get("lng") is None:
+            continue
+        d = calculate_distance_km(lat, lng, s["lat"], s["lng"])
+        if s["name"] not in candidates or d < candidates[s["name"]][0]:
+            candidates[s["name"]] = (d, s)
+    nearest = sorted(candidates.values(), key=lambda c: c[0])[:PREFETCH_STATIONS]
+
+    bundle = prediction_bundle.load_for(REGIONS.for_point(lat, lng).dataset().version)
+    generated = 0
+    for _, station in nearest:
+        nearest_station_name, _, estimated_minutes, prompt = prepare_prediction(
+            lat, lng, station["name"], station["lat"], station["lng"], line_id
         )
+        if bundle and bundle.lookup(nearest_station_name, station["name"]):
+            continue
+        cache_key = prediction_cache_key(
+            station["name"], nearest_station_name, estimated_minutes
+        )
+        if cache.get(cache_key) is not None:
+            continue
+
+        allowed, _ = prefetch_limiter.allow(f"prefetch:ip:{ip}")
+        if allowed:
+            allowed, _ = gpt_ip_limiter.allow(f"ip:{ip}")
+        if not allowed:
+            break
+        try:
+            payload = generate_prediction(
+                prompt,
+                estimated_minutes,
+                fallback_prediction(station["name"], estimated_minutes),
+                caller=prefetch_generate,
+            )
+        except llm_hedge.Overloaded:
+            break
+        if payload is not None:
+            cache.set(cache_key, dumps_bytes(payload), GPT_CACHE_TTL)
+            generated += 1
+
+    if generated:
+        print(f"🔮 prefetched {generated} predictions on {line_id}")
+
+
+@app.route("/api/gpt-prediction", methods=["POST"])
+def gpt_prediction():
+    data = request.json
+    lat = data.get("lat")
+    lng = data.get("lng")
+    station_name = data.get("station_name", "目的地")
+    station_lat = data.get("station_lat")
+    station_lng = data.get("station_lng")
+
+    # デバッグログ：受け取ったペイロードを出力
+    print(
+        f"[GPT Prediction] User Location: ({lat}, {lng}), Destination: {station_name} ({station_lat}, {station_lng})"
+    )
+
+    nearest_station_name, distance_km, estimated_minutes, prompt = prepare_prediction(
+        lat, lng, station_name, station_lat, station_lng, data.get("line_id")
+    )
+
+    print(f"[Distance] {distance_km:.2f}km, Estimated: {estimated_minutes}min")
+    print(f"[Nearest Station] {nearest_station_name}")
+
+    # 事前計算バンドルにあるペアなら LLM を呼ばずに返す（所要時間は GPS からの推定を優先）
+    bundle = prediction_bundle.load_for(
+        REGIONS.for_point(float(lat), float(lng)).dataset().version
+    )
+    bundled = bundle.lookup(nearest_station_name, station_name) if bundle else None
+    if bundled is not None:
+        print(f"[Bundle] hit {nearest_station_name} -> {station_name}")
+        return jsonify({**bundled, "minutes": estimated_minutes})
+
+    # 同じ「最寄り駅→目的駅・推定時間」の回答は全ワーカーで使い回す
+    # （路線を開いたときの先読みで作られていればここで当たる）
+    cache_key = prediction_cache_key(
+        station_name, nearest_station_name, estimated_minutes
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        print(f"[GPT Cache] hit {cache_key}")
+        return Response(cached, mimetype="application/json")
+
+    fallback = fallback_prediction(station_name, estimated_minutes)
+
+    # クライアントごとのレート制限。フロントは本文をそのまま表示するので予測も返す
+    allowed, retry_after = check_gpt_rate()
+    if not allowed:
+        response = jsonify(fallback)
+        response.status_code = 429
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+        return response
+
+    try:
+        # 締め切り超過・失敗・修復できない出力は待たずにローカルの予測を返す
+        payload = generate_prediction(prompt, estimated_minutes, fallback)
+    except llm_hedge.Overloaded:
+        # 同時実行数が上限なら待たずにローカルの予測を返す（負荷を捨てて p99 を守る）
+        print("⚠️ GPT admission full, shedding to local fallback")
+        response = jsonify(fallback)
+        response.headers["X-Load-Shed"] = "1"
+        return response
+    if payload is None:
+        return jsonify(fallback)
+
+    body = dumps_bytes(payload)
+    cache.set(cache_key, body, GPT_CACHE_TTL)
+    return Response(body, mimetype="application/json")
 
 
 if __name__ == "__main__":
+    if STATION_WATCH_INTERVAL > 0:
+        dataset.start_watcher(STATION_WATCH_INTERVAL)
+    if odpt_polling_enabled():
+        odpt_poller.start()
+    cpu_profile.install_signal_handler()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
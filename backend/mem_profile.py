@@ -0,0 +1,166 @@
+"""リクエストごとのメモリ割り当てのプロファイル（tracemalloc、明示的に有効化した時のみ）
+
+駅リストの組み立て（{**s, "line_color": ...}）や ODPT JSON の整形がリクエストごとに
+どれだけ確保しているかを測り、ワーカー数の見積もりと、駅データが増えたときの
+劣化検知に使う。
+
+    MEMORY_PROFILE=1                # 有効化（無効時は何もしない）
+    MEMORY_PROFILE_SAMPLE=0.05      # エンドポイントごとに計測するリクエストの割合
+    MEMORY_PROFILE_FRAMES=5         # 割り当て箇所として記録するスタックの深さ
+    MEMORY_PROFILE_DIR=/tmp         # dump() の出力先（ワーカーごとに memory-<pid>.json）
+
+計測は一度に1リクエストだけ（ロックが取れなければそのリクエストは計測しない）。
+tracemalloc はプロセス全体を追跡するので、同時に動いている他のスレッドの割り当ても
+多少混ざる。数値はエンドポイント間・バージョン間の比較用と考えること。
+"""
+
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import orjson
+from flask import g, request
+
+ENABLED = os.environ.get("MEMORY_PROFILE") == "1"
+SAMPLE_RATE = float(os.environ.get("MEMORY_PROFILE_SAMPLE", 0.05))
+FRAMES = int(os.environ.get("MEMORY_PROFILE_FRAMES", 5))
+DUMP_DIR = os.environ.get("MEMORY_PROFILE_DIR", tempfile.gettempdir())
+TOP_SITES = 10
+
+# プロファイラ自身（スナップショットの保持など）の割り当ては集計から除く
+_EXCLUDE = [
+    tracemalloc.Filter(False, tracemalloc.__file__, all_frames=True),
+    tracemalloc.Filter(False, __file__, all_frames=True),
+]
+
+_measure_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_endpoints = {}
+
+
+def _rss_kb():
+    """現在の RSS（KB）。/proc が無い環境では None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_kb():
+    # Linux の ru_maxrss は KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _before_request():
+    if random.random() >= SAMPLE_RATE or not _measure_lock.acquire(blocking=False):
+        return
+    snapshot = tracemalloc.take_snapshot().filter_traces(_EXCLUDE)
+    tracemalloc.reset_peak()
+    g.mem_profile = (snapshot, tracemalloc.get_traced_memory()[0], time.perf_counter())
+
+
+def _teardown_request(exc):
+    measured = g.pop("mem_profile", None)
+    if measured is None:
+        return
+    try:
+        before, base, started = measured
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(_EXCLUDE)
+        diff = after.compare_to(before, "traceback")
+        _record(
+            request.endpoint or "unknown",
+            net=current - base,
+            peak=peak - base,
+            elapsed=elapsed,
+            diff=diff,
+        )
+    finally:
+        _measure_lock.release()
+
+
+def _site(stat):
+    frames = stat.traceback
+    return " <- ".join(f"{f.filename}:{f.lineno}" for f in frames)
+
+
+def _record(endpoint, net, peak, elapsed, diff):
+    with _stats_lock:
+        e = _endpoints.setdefault(
+            endpoint,
+            {
+                "samples": 0,
+                "net_bytes": 0,
+                "max_peak_bytes": 0,
+                "profiled_ms": 0.0,
+                "sites": {},
+            },
+        )
+        e["samples"] += 1
+        e["net_bytes"] += net
+        e["max_peak_bytes"] = max(e["max_peak_bytes"], peak)
+        e["profiled_ms"] += elapsed * 1000
+        for stat in diff:
+            if stat.size_diff <= 0:
+                continue
+            site = e["sites"].setdefault(_site(stat), [0, 0])
+            site[0] += stat.size_diff
+            site[1] += stat.count_diff
+
+
+def report():
+    """このワーカーの集計（エンドポイントごとの平均割り当てと上位の割り当て箇所）"""
+    with _stats_lock:
+        endpoints = {}
+        for endpoint, e in _endpoints.items():
+            top = sorted(e["sites"].items(), key=lambda kv: kv[1][0], reverse=True)
+            endpoints[endpoint] = {
+                "samples": e["samples"],
+                "avg_net_bytes": e["net_bytes"] // e["samples"],
+                "max_peak_bytes": e["max_peak_bytes"],
+                # tracemalloc 有効時の所要時間（計測のオーバーヘッドを含む）
+                "avg_profiled_ms": round(e["profiled_ms"] / e["samples"], 3),
+                "top_sites": [
+                    {
+                        "site": site,
+                        "bytes_per_request": size // e["samples"],
+                        "blocks_per_request": round(count / e["samples"], 1),
+                    }
+                    for site, (size, count) in top[:TOP_SITES]
+                ],
+            }
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "pid": os.getpid(),
+        "enabled": ENABLED,
+        "sample_rate": SAMPLE_RATE,
+        "rss_kb": _rss_kb(),
+        "peak_rss_kb": _peak_rss_kb(),
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "endpoints": endpoints,
+    }
+
+
+def dump(directory=DUMP_DIR):
+    """集計をワーカーごとのファイルに書き出してパスを返す"""
+    path = os.path.join(directory, f"memory-{os.getpid()}.json")
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(report(), option=orjson.OPT_INDENT_2))
+    return path
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    tracemalloc.start(FRAMES)
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    print(f"🧠 memory profiling on (sample={SAMPLE_RATE}, frames={FRAMES})")
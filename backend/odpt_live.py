@@ -0,0 +1,160 @@
+"""ODPT の運行情報・列車位置のバックグラウンド取得
+
+/api/stations が使う odpt:Station は静的な駅一覧で、利用者がどれだけ車内に
+閉じ込められるかを左右する遅延・運転見合わせは見ていなかった。ここでは
+LINE_MAP の路線について odpt:TrainInformation（運行情報）と odpt:Train（在線列車と
+遅延秒数）を別スレッドで定期取得し、
+
+- 前回の ETag / Last-Modified を付けた条件付きリクエストで、変化が無ければ 304
+  （本文ハッシュが同じ場合も解析しない）
+- 路線ごとの状態を不変のタプル（LineStatus）として dict に置き、差し替えるだけ。
+  予測側は status(line_id) で O(1) に読む
+- 前回から状態が変わった路線だけログに出す
+
+ODPT_BASE_URL を replay_server.py に向ければ、記録したレスポンスでオフライン実行できる。
+"""
+
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+import requests
+
+# status: 運行情報の状態（"遅延" など。平常時は None）、text: 運行情報の本文
+# delay_minutes: 在線列車の最大遅延（分）、trains: 在線列車数
+LineStatus = namedtuple(
+    "LineStatus", ["status", "text", "delay_minutes", "trains", "updated"]
+)
+
+NORMAL = LineStatus(None, None, 0, 0, 0.0)
+
+RESOURCES = ("odpt:TrainInformation", "odpt:Train")
+
+
+def railway_of(line_urn):
+    """LINE_MAP の "odpt.Line:..." を運行情報 API が使う "odpt.Railway:..." にする"""
+    return line_urn.replace("odpt.Line:", "odpt.Railway:", 1)
+
+
+def _ja(value):
+    if isinstance(value, dict):
+        return value.get("ja") or value.get("en")
+    return value
+
+
+class LivePoller:
+    def __init__(self, base_url, api_key, line_map, interval=60, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.line_map = dict(line_map)
+        self.interval = interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        # URL ごとの条件付きリクエスト用ヘッダと本文ハッシュ
+        self._validators = {}
+        self._digests = {}
+        # 路線ごとの生データ（資源名 → レコードのリスト）
+        self._raw = {}
+        self._status = {}
+        self.stats = {"requests": 0, "not_modified": 0, "unchanged": 0, "errors": 0}
+
+    def status(self, line_id):
+        """路線の最新状態（未取得なら平常扱い）"""
+        return self._status.get(line_id, NORMAL)
+
+    def snapshot(self):
+        return {line_id: s._asdict() for line_id, s in self._status.items()}
+
+    def _fetch(self, resource, railway):
+        """変化があればレコードのリスト、無ければ None を返す"""
+        url = f"{self.base_url}/{resource}"
+        key = (resource, railway)
+        headers = {}
+        etag, last_modified = self._validators.get(key, (None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        params = {"odpt:railway": railway}
+        if self.api_key:
+            params["acl:consumerKey"] = self.api_key
+
+        self.stats["requests"] += 1
+        response = self.session.get(
+            url, params=params, headers=headers, timeout=self.timeout
+        )
+        if response.status_code == 304:
+            self.stats["not_modified"] += 1
+            return None
+        response.raise_for_status()
+        self._validators[key] = (
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        digest = hashlib.sha256(response.content).digest()
+        if self._digests.get(key) == digest:
+            self.stats["unchanged"] += 1
+            return None
+        self._digests[key] = digest
+        return response.json()
+
+    def _summarize(self, line_id):
+        raw = self._raw.get(line_id, {})
+        info = raw.get("odpt:TrainInformation") or [{}]
+        trains = raw.get("odpt:Train") or []
+        delays = [t.get("odpt:delay") or 0 for t in trains]
+        return LineStatus(
+            status=_ja(info[0].get("odpt:trainInformationStatus")),
+            text=_ja(info[0].get("odpt:trainInformationText")),
+            delay_minutes=round(max(delays, default=0) / 60),
+            trains=len(trains),
+            updated=time.time(),
+        )
+
+    def poll_once(self):
+        """全路線を1回取得し、状態が変わった路線 id のリストを返す"""
+        changed = []
+        for line_id, urn in self.line_map.items():
+            railway = railway_of(urn)
+            updated = False
+            for resource in RESOURCES:
+                try:
+                    records = self._fetch(resource, railway)
+                except (requests.RequestException, ValueError) as e:
+                    self.stats["errors"] += 1
+                    print(f"⚠️ ODPT {resource} for {line_id} failed: {e}")
+                    continue
+                if records is not None:
+                    self._raw.setdefault(line_id, {})[resource] = records
+                    updated = True
+            if not updated:
+                continue
+            before = self.status(line_id)
+            after = self._summarize(line_id)
+            self._status[line_id] = after
+            if before[:3] == after[:3]:
+                continue
+            changed.append(line_id)
+            if (before.status, before.delay_minutes) != (
+                after.status,
+                after.delay_minutes,
+            ):
+                print(
+                    f"🚃 {line_id}: {before.status or '平常'} → {after.status or '平常'}"
+                    f" (遅延 {after.delay_minutes}分, 在線 {after.trains}本)"
+                )
+        return changed
+
+    def _run(self):
+        while True:
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"⚠️ ODPT live poller error: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,261 @@
+"""駅ペアごとの事前計算済み予測バンドル
+
+地下では /api/gpt-prediction が最も必要なときに限って通信が切れる。全ての
+（出発駅, 目的駅）ペアについてルート・所要時間・トイレ情報・励ましメッセージを
+オフラインで一括計算し、gzip 圧縮した1ファイルにまとめる。サーバーはこれを
+静的に配信し（クライアントはキャッシュできる）、予測時もまずバンドルを引く。
+
+バンドルの構造（gzip 圧縮された JSON）:
+    {
+      "format": 2,
+      "dataset_version": "...",
+      "stations": ["東京駅", ...],          # 駅名（添字が駅番号）
+      "toilets": ["...", null, ...],       # 目的駅ごとのトイレ情報
+      "strings": ["...", ...],             # ステップ文・メッセージの文字列表
+      "pairs": [[null, [分, [ステップ文番号...], メッセージ番号], ...], ...]
+    }
+pairs[出発駅番号][目的駅番号] で O(1) に引ける（同じ駅同士は null）。
+
+トイレ情報・メッセージは LLM（--llm）でしか作れない。回答の無い目的駅は
+toilets が null・メッセージ番号が null のプレースホルダーで、lookup は返さない
+（固定の代替文で実際の予測を置き換えないよう、LLM か生成キャッシュに回す）。
+
+バンドルの作成（backend ディレクトリで）:
+    python prediction_bundle.py --out prediction_bundle.json.gz [--llm --rps 1 --checkpoint bundle_llm.jsonl]
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import zlib
+
+import llm_batch
+import schema
+
+FORMAT_VERSION = 2
+DEFAULT_PATH = os.environ.get(
+    "PREDICTION_BUNDLE_PATH",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "prediction_bundle.json.gz"
+    ),
+)
+
+
+class Bundle:
+    """読み込み済みのバンドル。compressed はそのまま配信できる gzip バイト列"""
+
+    def __init__(self, compressed):
+        self.compressed = compressed
+        data = json.loads(gzip.decompress(compressed))
+        self.format = data.get("format")
+        self.dataset_version = data["dataset_version"]
+        self.station_index = {name: i for i, name in enumerate(data["stations"])}
+        self.toilets = data["toilets"]
+        self.strings = data["strings"]
+        self.pairs = data["pairs"]
+
+    def lookup(self, origin_name, destination_name):
+        """予測ペイロード（minutes/steps/toilet_info/message）を返す。なければ None"""
+        o = self.station_index.get(origin_name)
+        d = self.station_index.get(destination_name)
+        if o is None or d is None or self.pairs[o][d] is None:
+            return None
+        # LLM の回答が無い目的駅（プレースホルダー）は使わない
+        if self.toilets[d] is None:
+            return None
+        minutes, step_ids, message_id = self.pairs[o][d]
+        return {
+            "minutes": minutes,
+            "steps": [self.strings[i] for i in step_ids],
+            "toilet_info": self.toilets[d],
+            "message": self.strings[message_id],
+        }
+
+
+_loaded = None
+_loaded_mtime = None
+
+
+def load(path=DEFAULT_PATH):
+    """バンドルを読み込む（ファイルが更新されていれば読み直す）。なければ None"""
+    global _loaded, _loaded_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _loaded is None or mtime != _loaded_mtime:
+        with open(path, "rb") as f:
+            _loaded = Bundle(f.read())
+        _loaded_mtime = mtime
+    return _loaded
+
+
+def load_for(version, path=DEFAULT_PATH):
+    """駅データ version から作られたバンドルを返す
+
+    無い場合と、駅データが更新された（ホットリロード）・別の地域のデータの場合、
+    形式の古いバンドル（プレースホルダーの区別が無い）の場合は None。
+    """
+    bundle = load(path)
+    if (
+        bundle is None
+        or bundle.format != FORMAT_VERSION
+        or bundle.dataset_version != version
+    ):
+        return None
+    return bundle
+
+
+# --- ここから下はバンドル作成（オフライン実行）用 ---
+
+
+def local_route(model, line_names, origin_id, destination_id):
+    """物理駅モデルの路線つながりから、乗り換えの少ないルートのステップ文を作る"""
+    origin = model.names[origin_id]
+    destination = model.names[destination_id]
+    legs = model.route(origin_id, destination_id)
+    if legs is None:
+        return [f"{destination}へ直行してください"]
+
+    first_line = model.line_ids[legs[0][0]]
+    steps = [f"{origin}から{line_names[first_line]}に乗車"]
+    for line, transfer_id in legs[1:]:
+        line_name = line_names[model.line_ids[line]]
+        steps.append(f"{model.names[transfer_id]}で{line_name}に乗り換え")
+    steps.append(f"{destination}で下車")
+    return steps
+
+
+def _destination_prompt(station_name):
+    """目的駅のトイレ情報と励ましメッセージ候補をまとめて聞くプロンプト"""
+    return f"""あなたはIBS（過敏性腸症候群）で苦しむユーザーを救う駅構内コンシェルジュです。
+「{station_name}」の駅構内トイレの位置と、15文字以内の励ましメッセージを5つ答えてください。
+
+【回答形式】必ずJSON形式のみで返してください
+{{
+  "toilet_info": "トイレの具体的な位置",
+  "messages": ["励まし1", "励まし2", "励まし3", "励まし4", "励まし5"]
+}}
+"""
+
+
+def build(use_llm=False, rps=1.0, concurrency=4, checkpoint_path=None):
+    """全駅ペアの予測を計算してバンドル（gzip バイト列）を返す"""
+    import main as app_main  # Flask アプリ・Gemini 設定を共有する（オフライン実行専用）
+
+    ds = app_main.dataset.current()
+    model = ds.model
+    names = model.names
+    line_names = {l["id"]: l["name"] for l in ds.lines}
+
+    # 目的駅ごとのトイレ情報・メッセージを LLM で一括生成（レート制限・チェックポイント付き）
+    generated = {}
+    if use_llm:
+        jobs = [
+            llm_batch.Job(
+                name, _destination_prompt(name), schema.DESTINATION_INFO_SCHEMA
+            )
+            for name in names
+        ]
+        generated = asyncio.run(
+            llm_batch.run_jobs(
+                jobs,
+                llm_batch.gemini_generate(app_main.model, app_main.genai),
+                concurrency=concurrency,
+                rps=rps,
+                checkpoint=llm_batch.Checkpoint(checkpoint_path),
+            )
+        )
+    # トイレ情報・メッセージがそろっていない目的駅はプレースホルダー（null）にする
+    toilets, messages = [], []
+    for name in names:
+        answer = generated.get(name, {})
+        complete = answer.get("toilet_info") and answer.get("messages")
+        toilets.append(answer["toilet_info"] if complete else None)
+        messages.append(answer["messages"] if complete else None)
+
+    strings, string_ids = [], {}
+
+    def intern(text):
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text)
+        return string_ids[text]
+
+    pairs = []
+    for o in range(len(model)):
+        row = []
+        for d in range(len(model)):
+            if o == d:
+                row.append(None)
+                continue
+            distance_km = app_main.calculate_distance_km(
+                model.lat[o], model.lng[o], model.lat[d], model.lng[d]
+            )
+            steps = local_route(model, line_names, o, d)
+            # 同じ目的駅でも出発駅ごとにメッセージを変える（決定的に選ぶ）
+            candidates = messages[d]
+            message_id = None
+            if candidates is not None:
+                message_id = intern(
+                    candidates[zlib.crc32(names[o].encode()) % len(candidates)]
+                )
+            row.append(
+                [
+                    app_main.estimate_travel_minutes(distance_km),
+                    [intern(step) for step in steps],
+                    message_id,
+                ]
+            )
+        pairs.append(row)
+
+    placeholders = sum(1 for t in toilets if t is None)
+    if placeholders:
+        print(
+            f"⚠️ {placeholders}/{len(names)} destinations have no LLM answer (not served)"
+        )
+
+    data = {
+        "format": FORMAT_VERSION,
+        "dataset_version": ds.version,
+        "stations": list(names),
+        "toilets": toilets,
+        "strings": strings,
+        "pairs": pairs,
+    }
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    return gzip.compress(raw, compresslevel=9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="駅ペア予測バンドルの作成")
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    parser.add_argument(
+        "--llm", action="store_true", help="トイレ情報・メッセージを Gemini で生成する"
+    )
+    parser.add_argument(
+        "--rps", type=float, default=1.0, help="LLM 呼び出しの上限（回/秒）"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--checkpoint", default=None, help="LLM 結果のチェックポイント（再開用）"
+    )
+    args = parser.parse_args()
+
+    compressed = build(
+        use_llm=args.llm,
+        rps=args.rps,
+        concurrency=args.concurrency,
+        checkpoint_path=args.checkpoint,
+    )
+    tmp_path = args.out + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp_path, args.out)
+    print(f"✅ wrote {args.out} ({len(compressed)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
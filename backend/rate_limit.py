@@ -0,0 +1,126 @@
+"""/api/gpt-prediction のレート制限と同時実行数の受け入れ制御
+
+Gemini 呼び出しは1回ごとに高価なので、1つのクライアント（やフロントエンドの
+リトライループ）がワーカーと LLM クォータを食い潰さないようにする。
+
+- TokenBucketLimiter: クライアント（セッション/IP）ごとのトークンバケット。
+  状態はホスト上の SQLite に置き、gunicorn の全ワーカーで共有する
+- AdmissionControl: ホスト全体での同時 LLM 呼び出し数の上限。スロットごとの
+  ロックファイルに flock を取り、空きが無ければ待たずに断る（呼び出し側は
+  ローカルのフォールバックを即座に返す）。プロセスが落ちればロックは自動で外れる
+"""
+
+import fcntl
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+# 状態の置き場所。/dev/shm があれば tmpfs 上に置き、ディスク I/O を避ける
+_BASE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+DEFAULT_PATH = os.environ.get(
+    "RATE_LIMIT_PATH", os.path.join(_BASE_DIR, "ibs-relief-ratelimit.sqlite3")
+)
+DEFAULT_SLOT_DIR = os.environ.get(
+    "ADMISSION_SLOT_DIR", os.path.join(_BASE_DIR, "ibs-relief-slots")
+)
+
+# この秒数より長く使われていないバケットは掃除する
+_IDLE_SECONDS = 3600
+
+
+class TokenBucketLimiter:
+    """rate_per_s 回/秒・最大 burst 回のトークンバケットをキーごとに持つ"""
+
+    def __init__(self, rate_per_s, burst, path=None):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.path = path or DEFAULT_PATH
+        self._local = threading.local()
+        self._calls = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def allow(self, key):
+        """1トークン消費できれば (True, 0)、できなければ (False, 再試行までの秒数)"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens = self.burst
+            if row is not None:
+                tokens = min(self.burst, row[0] + (now - row[1]) * self.rate_per_s)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                conn.execute(
+                    "DELETE FROM buckets WHERE updated < ?", (now - _IDLE_SECONDS,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if allowed:
+            return True, 0.0
+        return False, (1 - tokens) / self.rate_per_s
+
+
+class AdmissionControl:
+    """ホスト全体で最大 max_inflight 件まで同時実行を受け入れる"""
+
+    def __init__(self, max_inflight, directory=None):
+        self.max_inflight = max_inflight
+        self.directory = directory or DEFAULT_SLOT_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        # このプロセスでの受け入れ・拒否数（デバッグ用）
+        self.admitted = 0
+        self.rejected = 0
+
+    def _try_slot(self, slot):
+        path = os.path.join(self.directory, f"slot-{slot}")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+    def try_acquire(self):
+        """空きスロットのファイル記述子を返す。満杯なら None（待たない）"""
+        start = random.randrange(self.max_inflight)
+        for i in range(self.max_inflight):
+            fd = self._try_slot((start + i) % self.max_inflight)
+            if fd is not None:
+                self.admitted += 1
+                return fd
+        self.rejected += 1
+        return None
+
+    def release(self, fd):
+        # close で flock も解放される
+        os.close(fd)
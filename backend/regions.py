@@ -0,0 +1,135 @@
+"""地域（または事業者）ごとの駅データの分割
+
+stations.py と LINE_MAP は東京の6路線だけを前提にしていて、全ての検索が1つの
+駅リストを対象にしている。ここでは駅データを地域ごとのパーティションに分け、
+
+- 各パーティションは自分の Dataset（駅リスト・空間索引・検索索引など）と
+  ODPT の路線対応表（line_map）を持つ
+- 既定のパーティション（東京）は dataset モジュールのもの（ホットリロード対象）を使い、
+  それ以外は最初に使われたときに読み込む。ファイルが更新されていれば次のアクセスで
+  読み直す（prediction_bundle.load と同じ方式）
+- 座標を含むパーティションへ問い合わせを振り分ける。どこにも入らなければ既定
+
+ので、メモリと検索コストは国全体ではなく実際に使われている地域の分だけになる。
+
+追加の地域は REGIONS_PATH の JSON で定義する:
+
+    [{"name": "osaka", "bbox": [34.3, 135.0, 35.1, 135.8],
+      "stations_path": "data/osaka.json",
+      "line_map": {"osaka_loop": "odpt.Line:JR-West.OsakaLoop"}}]
+
+stations_path は STATIONS_DATA_PATH と同じ {"lines", "stations"} 形式
+（相対パスは REGIONS_PATH のディレクトリ基準）。路線 id は全地域で重複させないこと。
+"""
+
+import os
+import threading
+
+import orjson
+
+import dataset
+
+
+class Region:
+    def __init__(self, name, bbox, stations_path=None, line_map=None):
+        self.name = name
+        # (最小緯度, 最小経度, 最大緯度, 最大経度)
+        self.bbox = tuple(bbox)
+        self.stations_path = stations_path
+        self.line_map = dict(line_map or {})
+        self._dataset = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def contains(self, lat, lng):
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        return min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+    @property
+    def loaded(self):
+        return self.stations_path is None or self._dataset is not None
+
+    def dataset(self):
+        """このパーティションの Dataset（初回アクセス時・ファイル更新時に構築）"""
+        if self.stations_path is None:
+            return dataset.current()
+        mtime = os.path.getmtime(self.stations_path)
+        if self._dataset is not None and mtime == self._mtime:
+            return self._dataset
+        with self._lock:
+            if self._dataset is None or mtime != self._mtime:
+                self._dataset = dataset.Dataset(*dataset.read_file(self.stations_path))
+                self._mtime = mtime
+                print(
+                    f"🗾 region {self.name} loaded "
+                    f"({len(self._dataset.stations)} stations)"
+                )
+        return self._dataset
+
+
+class Registry:
+    def __init__(self, default, path=None):
+        self.default = default
+        self.regions = {default.name: default}
+        if path:
+            with open(path, "rb") as f:
+                config = orjson.loads(f.read())
+            base = os.path.dirname(os.path.abspath(path))
+            for entry in config:
+                self.regions[entry["name"]] = Region(
+                    entry["name"],
+                    entry["bbox"],
+                    os.path.join(base, entry["stations_path"]),
+                    entry.get("line_map"),
+                )
+
+    def get(self, name):
+        """名前からパーティションを返す（未指定なら既定、未登録なら None）"""
+        if not name:
+            return self.default
+        return self.regions.get(name)
+
+    def for_point(self, lat, lng):
+        """座標を含むパーティション。既定を優先し、どこにも入らなければ既定"""
+        if self.default.contains(lat, lng):
+            return self.default
+        for region in self.regions.values():
+            if region.contains(lat, lng):
+                return region
+        return self.default
+
+    def for_station(self, name):
+        """駅名を含むパーティション（既定を優先）。どこにも無ければ None
+
+        既定以外は必要になった地域から順に読み込む。
+        """
+        if name in self.default.dataset().model.name_to_id:
+            return self.default
+        for region in self.regions.values():
+            if region is not self.default and name in region.dataset().model.name_to_id:
+                return region
+        return None
+
+    def line_urn(self, line_id):
+        """全パーティションの line_map から ODPT の路線識別子を引く"""
+        for region in self.regions.values():
+            if line_id in region.line_map:
+                return region.line_map[line_id]
+        return None
+
+    def all_lines(self):
+        """全パーティションの line_map をまとめたもの（運行情報の取得対象）"""
+        merged = {}
+        for region in self.regions.values():
+            merged.update(region.line_map)
+        return merged
+
+    def summary(self):
+        return {
+            name: {
+                "bbox": region.bbox,
+                "loaded": region.loaded,
+                "lines": sorted(region.line_map),
+            }
+            for name, region in self.regions.items()
+        }
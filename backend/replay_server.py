@@ -0,0 +1,135 @@
+"""記録済みの ODPT レスポンスを返すローカルサーバー（オフライン実行・負荷試験用）
+
+使い方（backend ディレクトリで）:
+    python replay_server.py --dir recordings/odpt --port 5098
+    python replay_server.py --cassette cassette.jsonl --latency-scale 1.0
+    ODPT_BASE_URL=http://127.0.0.1:5098/api/v4 python main.py
+
+--cassette は cassette.py で記録した JSONL を、記録時の所要時間（に倍率をかけたもの）
+だけ待ってから返す。同じリクエストの記録が複数あれば記録順に巡回し、未記録の
+リクエストには記録全体から巡回して返す（上流の遅延分布を保ったまま負荷をかけられる）。
+
+--dir には資源ごとに "<資源名>.json"（例: "odpt:Train.json"）を置く。中身は
+ODPT API が返すのと同じレコードの配列。クエリの odpt:* / owl:* / dc:* は本物の
+API と同じく各レコードの同名フィールドとの一致で絞り込む（acl:consumerKey は無視）。
+ファイルは毎回読み直すので、書き換えれば運行情報の変化を再現できる。
+
+ETag / Last-Modified を返し、If-None-Match / If-Modified-Since には 304 で応える。
+"""
+
+import argparse
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import orjson
+
+from cassette import Cassette, Player, request_key
+
+FILTER_PREFIXES = ("odpt:", "owl:", "dc:")
+
+
+def filter_records(records, query):
+    """ODPT と同じく、指定されたフィールドが全て一致するレコードだけを残す"""
+    filters = [(k, v) for k, v in query if k.startswith(FILTER_PREFIXES)]
+    return [r for r in records if all(str(r.get(k)) == v for k, v in filters)]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    directory = "."
+    player = None
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _not_modified(self, etag, mtime=None):
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            return True
+        since = self.headers.get("If-Modified-Since")
+        if mtime is None or not since or self.headers.get("If-None-Match"):
+            return False
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    def _replay_cassette(self):
+        entry, _ = self.player.next(request_key("GET", self.path))
+        self.player.wait(entry)
+        headers = list(entry.get("headers", {}).items())
+        if self._not_modified(entry.get("headers", {}).get("ETag")):
+            self._send(304, headers=headers)
+            return
+        self._send(entry["status"], entry["body"].encode(), headers)
+
+    def do_GET(self):
+        if self.player is not None:
+            self._replay_cassette()
+            return
+        url = urlsplit(self.path)
+        resource = unquote(url.path.rstrip("/").rsplit("/", 1)[-1])
+        path = os.path.join(self.directory, f"{resource}.json")
+        if not resource or not os.path.isfile(path):
+            self._send(404, b"[]", [("Content-Type", "application/json")])
+            return
+
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            records = orjson.loads(f.read())
+        body = orjson.dumps(filter_records(records, parse_qsl(url.query)))
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        last_modified = formatdate(mtime, usegmt=True)
+        headers = [("ETag", etag), ("Last-Modified", last_modified)]
+
+        if self._not_modified(etag, mtime):
+            self._send(304, headers=headers)
+            return
+        self._send(200, body, headers + [("Content-Type", "application/json")])
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory=None, host="127.0.0.1", port=5098, cassette=None, scale=1.0):
+    attrs = {"directory": directory}
+    if cassette is not None:
+        # 304 の記録は再生しない（条件付きリクエストへの 304 はこちらで判定する）
+        entries = [e for e in Cassette(cassette).entries("odpt") if e["status"] != 304]
+        attrs["player"] = Player(entries, latency_scale=scale)
+    handler = type("Handler", (ReplayHandler,), attrs)
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"📼 replaying {cassette or directory} on http://{host}:{port}/api/v4")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="記録済みレスポンスのディレクトリ")
+    source.add_argument("--cassette", help="cassette.py で記録した JSONL")
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="記録時の所要時間にかける倍率（0 で待たない）",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5098)
+    args = parser.parse_args()
+    serve(
+        args.dir, args.host, args.port, args.cassette, args.latency_scale
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""LLM 出力の JSON スキーマと簡易バリデータ
+
+JSON Schema のうち、ここで使うサブセット（type / required / properties /
+items / minItems / maxItems / minLength / maxLength / minimum / maximum）だけを
+実装する。外部ライブラリなしで、バッチ処理・リアルタイム両方から使う。
+"""
+
+# /api/gpt-prediction の回答形式
+PREDICTION_SCHEMA = {
+    "type": "object",
+    "required": ["minutes", "steps", "toilet_info", "message"],
+    "properties": {
+        "minutes": {"type": "integer", "minimum": 1, "maximum": 600},
+        "steps": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 10,
+            "items": {"type": "string", "minLength": 1, "maxLength": 200},
+        },
+        "toilet_info": {"type": "string", "minLength": 1, "maxLength": 300},
+        "message": {"type": "string", "minLength": 1, "maxLength": 40},
+    },
+}
+
+# 予測バンドル作成時に目的駅ごとに聞く回答形式
+DESTINATION_INFO_SCHEMA = {
+    "type": "object",
+    "required": ["toilet_info", "messages"],
+    "properties": {
+        "toilet_info": {"type": "string", "minLength": 1, "maxLength": 300},
+        "messages": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 10,
+            "items": {"type": "string", "minLength": 1, "maxLength": 40},
+        },
+    },
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+
+def validate(value, schema, path="$"):
+    """スキーマ違反の説明文のリストを返す（空なら妥当）"""
+    expected = schema.get("type")
+    if expected:
+        # bool は int のサブクラスなので数値としては受け付けない
+        if isinstance(value, bool) and expected != "boolean":
+            return [f"{path}: expected {expected}, got boolean"]
+        if not isinstance(value, _TYPES[expected]):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing {key}")
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], sub, f"{path}.{key}"))
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: more than {schema['maxItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    elif isinstance(value, str):
+        if len(value) < schema.get("minLength", 0):
+            errors.append(f"{path}: shorter than {schema['minLength']}")
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            errors.append(f"{path}: longer than {schema['maxLength']}")
+    elif isinstance(value, (int, float)):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: below {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: above {schema['maximum']}")
+    return errors
@@ -0,0 +1,161 @@
+"""ワーカー間で共有するローカルキャッシュ（SQLite WAL モード）
+
+gunicorn の各ワーカーが個別に dict キャッシュを持つと、N ワーカーで N 回の
+コールドミスと N 倍のメモリが発生する。同一ホスト上の SQLite ファイル1つを
+全ワーカーで共有し、TTL とサイズ上限（古いものから追い出し）を持たせる。
+
+値はエンコード済みの bytes（JSON レスポンス本体など）のまま保存する。
+ヒット時はデシリアライズせずそのままレスポンスに使える。読み込みは
+mmap_size でメモリマップされたページから行われ、read() のコピーも減る。
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# アクセス時刻の更新間隔（秒）。毎回書き込むと読み込みが書き込みトランザクションになるため
+_TOUCH_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (id, total_bytes) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_ins AFTER INSERT ON entries BEGIN
+    UPDATE meta SET total_bytes = total_bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_del AFTER DELETE ON entries BEGIN
+    UPDATE meta SET total_bytes = total_bytes - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_upd AFTER UPDATE OF size ON entries BEGIN
+    UPDATE meta SET total_bytes = total_bytes - OLD.size + NEW.size WHERE id = 0;
+END;
+"""
+
+
+def escape_like(text):
+    """LIKE パターン中でそのまま一致させたい文字列をエスケープする"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _default_path():
+    # /dev/shm があれば tmpfs 上に置き、ディスク I/O を避ける
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "ibs-relief-cache.sqlite3")
+
+
+class SharedCache:
+    """TTL・サイズ上限付きのプロセス間共有キャッシュ"""
+
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024, mmap_bytes=None):
+        self.path = path or _default_path()
+        self.max_bytes = max_bytes
+        self.mmap_bytes = mmap_bytes if mmap_bytes is not None else max_bytes * 2
+        self._local = threading.local()
+
+    def _conn(self):
+        # 接続はスレッドごと・プロセスごと（fork 前の接続は子プロセスで使わない）
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+        conn.executescript(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """値（bytes）を返す。未登録・期限切れなら None"""
+        now = time.time()
+        row = (
+            self._conn()
+            .execute(
+                "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?",
+                (key,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at <= now:
+            return None
+        if now - accessed_at > _TOUCH_INTERVAL:
+            self._conn().execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return value
+
+    def set(self, key, value, ttl):
+        """bytes を ttl 秒間保存する。上限を超えたら古いものから追い出す"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO entries (key, value, size, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+            "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+            (key, value, len(value), now + ttl, now),
+        )
+        total = conn.execute("SELECT total_bytes FROM meta WHERE id = 0").fetchone()[0]
+        if total > self.max_bytes:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        # 期限切れを消し、まだ多ければアクセスの古い順に上限の 90% まで削る
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            total = conn.execute(
+                "SELECT total_bytes FROM meta WHERE id = 0"
+            ).fetchone()[0]
+            target = self.max_bytes * 0.9
+            if total > target:
+                freed = 0
+                victims = []
+                for key, size in conn.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed_at"
+                ):
+                    victims.append((key,))
+                    freed += size
+                    if total - freed <= target:
+                        break
+                conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        """prefix で始まるキーをまとめて削除する"""
+        self.delete_like(escape_like(prefix) + "%")
+
+    def delete_like(self, pattern):
+        """SQL の LIKE パターン（エスケープ文字は \\）に一致するキーを削除し、件数を返す"""
+        cursor = self._conn().execute(
+            "DELETE FROM entries WHERE key LIKE ? ESCAPE '\\'", (pattern,)
+        )
+        return cursor.rowcount
+
+    def clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+
+cache = SharedCache(
+    path=os.environ.get("SHARED_CACHE_PATH"),
+    max_bytes=int(os.environ.get("SHARED_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
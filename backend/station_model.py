@@ -0,0 +1,122 @@
+"""物理駅と路線所属の正規化モデル
+
+stations.STATIONS では同じ駅（新宿駅・渋谷駅など）が路線ごとに別レコードとして
+重複している。ここでは
+
+- 物理駅テーブル: 整数 id → 駅名（intern 済み）・座標
+- 駅・路線の所属テーブル: 物理駅 id ⇔ 路線番号、元レコードの添字
+- 駅名 → 物理駅 id の索引
+
+を作り、最寄り駅探索・除外・乗り換え判定を文字列比較ではなく整数 id で行う。
+"""
+
+import math
+import sys
+from array import array
+
+
+class StationModel:
+    def __init__(self, station_list, line_list):
+        self.line_ids = [l["id"] for l in line_list]
+        line_index = {line_id: i for i, line_id in enumerate(self.line_ids)}
+
+        self.names = []
+        self.name_to_id = {}
+        # 物理駅ごとの座標（最初に現れたレコードの値）と、その代表レコードの添字
+        self.lat = array("d")
+        self.lng = array("d")
+        self.first_record = array("i")
+        # 元レコードの添字 → 物理駅 id
+        self.record_station = array("i")
+        # 所属テーブル: 物理駅 id → 路線番号のタプル、路線番号 → 物理駅 id のタプル
+        lines_of = []
+        stations_of = [[] for _ in self.line_ids]
+
+        for record_index, s in enumerate(station_list):
+            name = sys.intern(s["name"])
+            station_id = self.name_to_id.get(name)
+            if station_id is None:
+                station_id = len(self.names)
+                self.name_to_id[name] = station_id
+                self.names.append(name)
+                self.lat.append(s["lat"])
+                self.lng.append(s["lng"])
+                self.first_record.append(record_index)
+                lines_of.append([])
+            self.record_station.append(station_id)
+
+            line = line_index.get(s["line_id"].strip())
+            if line is not None and line not in lines_of[station_id]:
+                lines_of[station_id].append(line)
+                stations_of[line].append(station_id)
+
+        self.lines_of = [tuple(lines) for lines in lines_of]
+        self.stations_of = [tuple(ids) for ids in stations_of]
+        self._station_sets = [frozenset(ids) for ids in stations_of]
+
+        # 最寄り駅探索用: (緯度rad, 経度rad, cos(緯度))
+        self.coords = [
+            (math.radians(lat), math.radians(lng), math.cos(math.radians(lat)))
+            for lat, lng in zip(self.lat, self.lng)
+        ]
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, name):
+        """駅名から物理駅 id を返す（未登録なら None）"""
+        return self.name_to_id.get(name)
+
+    def nearest(self, lat, lng, exclude_id=None):
+        """現在地に最も近い物理駅 id（exclude_id は除く）"""
+        lat1, lon1 = math.radians(lat), math.radians(lng)
+        cos_lat1 = math.cos(lat1)
+        # asin/sqrt は単調増加なので、比較にはハバーサインの a 値だけを使う
+        best_id, best_a = None, float("inf")
+        for station_id, (lat2, lon2, cos_lat2) in enumerate(self.coords):
+            if station_id == exclude_id:
+                continue
+            a = (
+                math.sin((lat2 - lat1) / 2) ** 2
+                + cos_lat1 * cos_lat2 * math.sin((lon2 - lon1) / 2) ** 2
+            )
+            if a < best_a:
+                best_id, best_a = station_id, a
+        return best_id
+
+    def transfers(self, line_a, line_b):
+        """2路線の両方に所属する物理駅 id（乗換駅）"""
+        return self._station_sets[line_a] & self._station_sets[line_b]
+
+    def route(self, origin_id, destination_id):
+        """乗り換えの少ない路線列を幅優先で探す
+
+        [(路線番号, 乗換駅id), ...] を返す。最初の要素の乗換駅は None（出発駅から乗車）。
+        つながらなければ None。
+        """
+        targets = set(self.lines_of[destination_id])
+        previous = {line: None for line in self.lines_of[origin_id]}
+        queue = list(self.lines_of[origin_id])
+        found = next((line for line in queue if line in targets), None)
+        while queue and found is None:
+            line = queue.pop(0)
+            for other in range(len(self.line_ids)):
+                if other not in previous and self.transfers(line, other):
+                    previous[other] = line
+                    queue.append(other)
+                    if other in targets:
+                        found = other
+                        break
+        if found is None:
+            return None
+
+        path = [found]
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        path.reverse()
+
+        legs = [(path[0], None)]
+        for before, after in zip(path, path[1:]):
+            transfer = min(self.transfers(before, after), key=lambda i: self.names[i])
+            legs.append((after, transfer))
+        return legs
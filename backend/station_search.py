@@ -0,0 +1,333 @@
+"""駅名検索（漢字・かな・ローマ字、前方一致 + 2-gram による部分一致・誤字許容）
+
+索引は物理駅（StationModel の id）ごとに次のキーを持つ。
+
+- 漢字の駅名（"新宿駅"）と「駅」を除いた名前（"新宿"）
+- name_en の小文字ローマ字（"shinjuku"）
+- ローマ字から起こしたひらがなの読み（"しんじゅく"）
+
+キーとクエリは同じ正規化（NFKC・小文字化・カタカナ→ひらがな・長音の畳み込み）を
+通すので、"シンジュク" や "とうきょう"（name_en は長音記号なしの "Tokyo"）でも当たる。
+
+検索は (1) ソート済みキー列の二分探索による前方一致、(2) 2-gram の転置索引による
+部分一致、(3) ほぼ同じ位置で 2-gram を多く共有する上位 FUZZY_CANDIDATES 件に対する
+上限付き編集距離（ビット並列、誤字許容）の順に行い、一致の質 → 現在地からの距離 →
+駅名の順に並べる。索引は Dataset の構築時に1回だけ作る。
+"""
+
+import bisect
+import heapq
+import math
+import unicodedata
+
+from geo_index import haversine_km
+
+# 誤字許容で編集距離を計算する候補の上限（共有する 2-gram の多い順）
+FUZZY_CANDIDATES = 32
+
+# ローマ字 → ひらがな（長いつづりから優先して照合する）
+_ROMAJI = {
+    "a": "あ", "i": "い", "u": "う", "e": "え", "o": "お",
+    "ka": "か", "ki": "き", "ku": "く", "ke": "け", "ko": "こ",
+    "sa": "さ", "shi": "し", "si": "し", "su": "す", "se": "せ", "so": "そ",
+    "ta": "た", "chi": "ち", "ti": "ち", "tsu": "つ", "tu": "つ", "te": "て", "to": "と",
+    "na": "な", "ni": "に", "nu": "ぬ", "ne": "ね", "no": "の",
+    "ha": "は", "hi": "ひ", "fu": "ふ", "hu": "ふ", "he": "へ", "ho": "ほ",
+    "ma": "ま", "mi": "み", "mu": "む", "me": "め", "mo": "も",
+    "ya": "や", "yu": "ゆ", "yo": "よ",
+    "ra": "ら", "ri": "り", "ru": "る", "re": "れ", "ro": "ろ",
+    "wa": "わ", "wo": "を",
+    "ga": "が", "gi": "ぎ", "gu": "ぐ", "ge": "げ", "go": "ご",
+    "za": "ざ", "ji": "じ", "zi": "じ", "zu": "ず", "ze": "ぜ", "zo": "ぞ",
+    "da": "だ", "di": "ぢ", "du": "づ", "de": "で", "do": "ど",
+    "ba": "ば", "bi": "び", "bu": "ぶ", "be": "べ", "bo": "ぼ",
+    "pa": "ぱ", "pi": "ぴ", "pu": "ぷ", "pe": "ぺ", "po": "ぽ",
+    "sha": "しゃ", "shu": "しゅ", "she": "しぇ", "sho": "しょ",
+    "cha": "ちゃ", "chu": "ちゅ", "che": "ちぇ", "cho": "ちょ",
+    "ja": "じゃ", "ju": "じゅ", "je": "じぇ", "jo": "じょ",
+    "fa": "ふぁ", "fi": "ふぃ", "fe": "ふぇ", "fo": "ふぉ",
+    "va": "ゔぁ", "vi": "ゔぃ", "vu": "ゔ", "ve": "ゔぇ", "vo": "ゔぉ",
+}  # fmt: skip
+for _consonant, _kana in {
+    "k": "き", "s": "し", "t": "ち", "n": "に", "h": "ひ", "m": "み",
+    "r": "り", "g": "ぎ", "z": "じ", "b": "び", "p": "ぴ",
+}.items():  # fmt: skip
+    for _vowel, _small in (("a", "ゃ"), ("u", "ゅ"), ("o", "ょ")):
+        _ROMAJI[f"{_consonant}y{_vowel}"] = _kana + _small
+_ROMAJI_MAX_LEN = max(len(k) for k in _ROMAJI)
+
+# 長音の畳み込みに使う、かな1文字の母音
+_KANA_VOWEL = {}
+for _romaji, _kana in _ROMAJI.items():
+    _KANA_VOWEL.setdefault(_kana[-1], _romaji[-1])
+_KANA_VOWEL.update({"ゃ": "a", "ゅ": "u", "ょ": "o"})
+
+
+def romaji_to_hiragana(text):
+    """ヘボン式（と訓令式の一部）のローマ字をひらがなにする。変換できない文字は残す"""
+    text = text.lower()
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        nxt = text[i + 1] if i + 1 < len(text) else ""
+        # 促音: 同じ子音の連続（"tch" も促音）
+        if c.isalpha() and c not in "aiueon" and (nxt == c or text[i : i + 3] == "tch"):
+            out.append("っ")
+            i += 1
+            continue
+        # 撥音: "n'"、子音（y 以外）・語末の前の "n"、b/p/m の前の "m"
+        # "nn" は後ろに母音が続けば "ん" + な行（"shinnakano"）、続かなければ "ん"
+        if c == "n" and (nxt == "" or nxt not in "aiueoy"):
+            after = text[i + 2] if i + 2 < len(text) else ""
+            out.append("ん")
+            i += 2 if nxt == "'" or (nxt == "n" and after not in "aiueoy") else 1
+            continue
+        if c == "m" and nxt in ("b", "p", "m"):
+            out.append("ん")
+            i += 1
+            continue
+        for length in range(_ROMAJI_MAX_LEN, 0, -1):
+            kana = _ROMAJI.get(text[i : i + length])
+            if kana is not None:
+                out.append(kana)
+                i += length
+                break
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def _katakana_to_hiragana(text):
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+
+def _fold_kana(text):
+    """長音を畳む: "とうきょう" → "ときょ"、"おおさき" → "おさき"、"ー" は消す"""
+    out = []
+    for c in text:
+        if c == "ー":
+            continue
+        if out and (
+            (c == "う" and _KANA_VOWEL.get(out[-1]) in ("o", "u"))
+            or (c == "お" and _KANA_VOWEL.get(out[-1]) == "o")
+        ):
+            continue
+        out.append(c)
+    return "".join(out)
+
+
+def _fold_romaji(text):
+    """ローマ字の長音・表記ゆれを畳む: ou/oo/oh → o、uu → u、mb/mp → nb/np"""
+    for before, after in (
+        ("ou", "o"),
+        ("oo", "o"),
+        ("oh", "o"),
+        ("uu", "u"),
+        ("mb", "nb"),
+        ("mp", "np"),
+    ):
+        text = text.replace(before, after)
+    return text
+
+
+def normalize(text):
+    """索引キーとクエリに共通の正規化"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = "".join(c for c in text if c not in " -'・.")
+    text = _katakana_to_hiragana(text)
+    if text.isascii():
+        return _fold_romaji(text)
+    return _fold_kana(text)
+
+
+def _bigrams(text):
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def _max_edits(query):
+    if query.isascii():
+        return 0 if len(query) <= 2 else 1 if len(query) <= 5 else 2
+    return 0 if len(query) <= 1 else 1
+
+
+def _char_masks(query):
+    """文字 → query 内でその文字がある位置のビットマスク"""
+    masks = {}
+    for i, c in enumerate(query):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    return masks
+
+
+def prefix_edit_distance(query, key, limit, masks=None):
+    """query と key の先頭部分との最小編集距離。limit を超えたら None
+
+    Myers / Hyyrö のビット並列法で、key の1文字ごとに DP 表の1列（query の全行）を
+    整数演算数回で進める。masks は _char_masks(query)（同じ query で何度も呼ぶとき用）。
+    """
+    if not query:
+        return 0
+    # len(query) + limit より長い先頭部分は距離が limit を超えるので見ない
+    key = key[: len(query) + limit]
+    if masks is None:
+        masks = _char_masks(query)
+    full = (1 << len(query)) - 1
+    top = 1 << (len(query) - 1)
+    # 縦方向の差分（+1 / -1）のビット列。score は DP 表の最下行（query 全体との距離）
+    vp, vn = full, 0
+    score = best = len(query)
+    for c in key:
+        eq = masks.get(c, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        ph = vn | (~(xh | vp) & full)
+        mh = vp & xh
+        if ph & top:
+            score += 1
+        elif mh & top:
+            score -= 1
+        # 先頭行は key の長さぶん増える（key の先頭から合わせる）ので 1 を入れる
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        vp = mh | (~(xv | ph) & full)
+        vn = ph & xv
+        best = min(best, score)
+    return best if best <= limit else None
+
+
+# 一致の質（小さいほど良い）
+EXACT, PREFIX, SUBSTRING, FUZZY = range(4)
+MATCH_NAMES = ("exact", "prefix", "substring", "fuzzy")
+
+
+class StationSearch:
+    def __init__(self, model, station_list):
+        self.model = model
+        entries = set()
+        for station_id, name in enumerate(model.names):
+            record = station_list[model.first_record[station_id]]
+            name_en = record.get("name_en") or ""
+            for key in (
+                name,
+                name.removesuffix("駅"),
+                name_en,
+                romaji_to_hiragana(name_en),
+            ):
+                key = normalize(key)
+                if key:
+                    entries.add((key, station_id))
+        entries = sorted(entries)
+        self.keys = [key for key, _ in entries]
+        self.key_station = [station_id for _, station_id in entries]
+
+        # 2-gram → キー番号のリスト（部分一致の候補出し）
+        self.bigram_index = {}
+        # (2-gram, キー内の位置) → キー番号のリスト（誤字許容の候補出し）
+        self.bigram_at = {}
+        for key_index, key in enumerate(self.keys):
+            for gram in _bigrams(key):
+                self.bigram_index.setdefault(gram, []).append(key_index)
+            for pos in range(len(key) - 1):
+                self.bigram_at.setdefault((key[pos : pos + 2], pos), []).append(
+                    key_index
+                )
+
+    def _prefix_matches(self, query):
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + "\U0010ffff", lo=start)
+        return range(start, end)
+
+    def _substring_candidates(self, query):
+        """query の 2-gram のうち、出現するキーが最も少ないものの転置リスト"""
+        return min(
+            (self.bigram_index.get(gram, ()) for gram in _bigrams(query)), key=len
+        )
+
+    def _fuzzy_candidates(self, query, limit):
+        """{キー番号: 位置のずれが limit 以内で共有する 2-gram の数}
+
+        編集 limit 回以内で一致する先頭部分なら、壊れなかった 2-gram は
+        キー側でも高々 limit 文字しかずれない。
+        """
+        counts = {}
+        for i in range(len(query) - 1):
+            gram = query[i : i + 2]
+            for pos in range(max(0, i - limit), i + limit + 1):
+                for key_index in self.bigram_at.get((gram, pos), ()):
+                    counts[key_index] = counts.get(key_index, 0) + 1
+        return counts
+
+    def matches(self, query):
+        """{物理駅 id: (一致の質, 編集距離)} を返す"""
+        best = {}
+
+        def offer(key_index, quality, edits=0):
+            station_id = self.key_station[key_index]
+            current = best.get(station_id)
+            if current is None or (quality, edits) < current:
+                best[station_id] = (quality, edits)
+
+        for key_index in self._prefix_matches(query):
+            offer(key_index, EXACT if self.keys[key_index] == query else PREFIX)
+
+        if len(query) < 2:
+            # 漢字1文字（"宿" など）は 2-gram が無いので、キー列を直接なめる
+            if not query.isascii():
+                for key_index, key in enumerate(self.keys):
+                    if query in key:
+                        offer(key_index, SUBSTRING)
+            return best
+
+        # 部分一致なら query の全 2-gram を含むので、最も珍しい 2-gram のキーだけ調べる
+        for key_index in self._substring_candidates(query):
+            if query in self.keys[key_index]:
+                offer(key_index, SUBSTRING)
+
+        limit = _max_edits(query)
+        if limit:
+            # 編集1回で壊れる 2-gram は高々2個なので、それ以上共有していない候補は捨てる。
+            # 先頭部分が query より limit 文字以上短いキーも一致しえない
+            needed = max(1, len(query) - 1 - 2 * limit)
+            min_len = len(query) - limit
+            viable = [
+                (shared, key_index)
+                for key_index, shared in self._fuzzy_candidates(query, limit).items()
+                if shared >= needed
+                and len(self.keys[key_index]) >= min_len
+                and self.key_station[key_index] not in best
+            ]
+            # 駅数が多いと共有 2-gram の少ない候補が大量に残るので、多い順に上限まで
+            masks = _char_masks(query)
+            for _, key_index in heapq.nlargest(FUZZY_CANDIDATES, viable):
+                edits = prefix_edit_distance(query, self.keys[key_index], limit, masks)
+                if edits is not None:
+                    offer(key_index, FUZZY, edits)
+        return best
+
+    def search(self, text, lat=None, lng=None, limit=10):
+        """[(物理駅 id, 一致の質, 距離km または None), ...] を良い順に返す"""
+        query = normalize(text)
+        if not query:
+            return []
+        located = lat is not None and lng is not None
+        if located:
+            lat1, lon1 = math.radians(lat), math.radians(lng)
+            cos_lat1 = math.cos(lat1)
+        ranked = []
+        for station_id, (quality, edits) in self.matches(query).items():
+            distance = (
+                haversine_km(lat1, lon1, cos_lat1, self.model.coords[station_id])
+                if located
+                else None
+            )
+            ranked.append(
+                (
+                    (quality, edits, distance or 0.0, self.model.names[station_id]),
+                    station_id,
+                    quality,
+                    distance,
+                )
+            )
+        ranked.sort()
+        return [(station_id, q, d) for _, station_id, q, d in ranked[:limit]]
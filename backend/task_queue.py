@@ -0,0 +1,145 @@
+"""プロセス内のタスクキューとワーカースレッド
+
+ODPT の再取得（リトライ込みで最大数十秒）や実測ログの書き込み、予測の先読みを
+リクエスト処理の中でやらないためのもの。ハンドラは enqueue して、結果は共有
+キャッシュなどから読むだけにする。外部サービス（Redis など）は使わない。
+
+- 同じ key のタスクが待ち行列・実行中にあれば積まない（重複排除）
+- 待ち行列が max_depth を超えたら積まずに捨てる（呼び出し側は待たない）
+- 種類ごとに積んだ数・重複・破棄・成功・失敗、待ち時間・実行時間を集計する
+- ワーカースレッドは最初の enqueue で起動する（gunicorn の fork 後にプロセスごとに作られる）
+
+    tasks.enqueue("odpt", f"odpt:{line_id}", refresh_odpt_line, line_id)
+"""
+
+import os
+import queue
+import threading
+import time
+
+
+class _KindStats:
+    __slots__ = (
+        "enqueued",
+        "deduped",
+        "dropped",
+        "done",
+        "failed",
+        "wait_ms",
+        "max_wait_ms",
+        "run_ms",
+        "max_run_ms",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def snapshot(self):
+        finished = self.done + self.failed
+        return {
+            "enqueued": self.enqueued,
+            "deduped": self.deduped,
+            "dropped": self.dropped,
+            "done": self.done,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.wait_ms / finished, 3) if finished else None,
+            "max_wait_ms": round(self.max_wait_ms, 3),
+            "avg_run_ms": round(self.run_ms / finished, 3) if finished else None,
+            "max_run_ms": round(self.max_run_ms, 3),
+        }
+
+
+class TaskQueue:
+    def __init__(self, workers=4, max_depth=1000, name="task"):
+        self.name = name
+        self.workers = workers
+        self.max_depth = max_depth
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # 待ち行列にある・実行中の key
+        self._pending = set()
+        self._running = 0
+        self._stats = {}
+        self._pid = None
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 後の子プロセスには親のスレッドが無いので作り直す
+            self._queue = queue.Queue()
+            self._pending = set()
+            self._running = 0
+            for i in range(self.workers):
+                threading.Thread(
+                    target=self._work, name=f"{self.name}-worker-{i}", daemon=True
+                ).start()
+            self._pid = os.getpid()
+
+    def enqueue(self, kind, key, fn, *args, **kwargs):
+        """タスクを積む。積めれば True、重複・満杯なら False（待たない）
+
+        key が None のタスクは重複排除しない（ログの追記など、毎回実行するもの）。
+        """
+        self._ensure_workers()
+        with self._lock:
+            stats = self._stats.setdefault(kind, _KindStats())
+            if key is not None and key in self._pending:
+                stats.deduped += 1
+                return False
+            if self._queue.qsize() >= self.max_depth:
+                stats.dropped += 1
+                return False
+            if key is not None:
+                self._pending.add(key)
+            stats.enqueued += 1
+        self._queue.put((kind, key, fn, args, kwargs, time.perf_counter()))
+        return True
+
+    def _work(self):
+        while True:
+            kind, key, fn, args, kwargs, enqueued_at = self._queue.get()
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+            ok = True
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                ok = False
+                print(f"⚠️ task {key or kind} failed: {e}")
+            finished = time.perf_counter()
+            wait_ms = (started - enqueued_at) * 1000
+            run_ms = (finished - started) * 1000
+            with self._lock:
+                self._running -= 1
+                self._pending.discard(key)
+                stats = self._stats[kind]
+                if ok:
+                    stats.done += 1
+                else:
+                    stats.failed += 1
+                stats.wait_ms += wait_ms
+                stats.max_wait_ms = max(stats.max_wait_ms, wait_ms)
+                stats.run_ms += run_ms
+                stats.max_run_ms = max(stats.max_run_ms, run_ms)
+
+    def pending(self, key):
+        """key のタスクが待ち行列・実行中にあるか"""
+        with self._lock:
+            return key in self._pending
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "name": self.name,
+                "workers": self.workers,
+                "depth": self._queue.qsize(),
+                "running": self._running,
+                "max_depth": self.max_depth,
+                "kinds": {kind: s.snapshot() for kind, s in self._stats.items()},
+            }
@@ -0,0 +1,69 @@
+"""CPU プロファイラ: 待っているだけのスレッドではなく CPU を使うスレッドが結果に出ること"""
+
+import queue
+import threading
+import time
+
+import pytest
+
+import cpu_profile
+
+
+def _spin(stop):
+    x = 0
+    while not stop.is_set():
+        x += sum(range(1000))
+
+
+def _wait_for(path, timeout_s=10):
+    # time.sleep ではなく Event で待つ（葉のフレームが threading になり待ちと判定される）
+    pause = threading.Event()
+    deadline = time.monotonic() + timeout_s
+    while cpu_profile.status()["running"]:
+        assert time.monotonic() < deadline, "profiler did not finish"
+        pause.wait(0.05)
+    assert cpu_profile.status()["output"] == path
+
+
+def _read_folded(path):
+    weights = {}
+    with open(path) as f:
+        for line in f:
+            stack, _, weight = line.rstrip("\n").rpartition(" ")
+            weights[stack] = int(weight)
+    return weights
+
+
+@pytest.mark.parametrize("per_thread_cpu", [True, False])
+def test_cpu_bound_thread_dominates(tmp_path, monkeypatch, per_thread_cpu):
+    monkeypatch.setattr(cpu_profile, "OUTPUT_DIR", str(tmp_path))
+    if not per_thread_cpu:
+        # スレッドごとの CPU 時計が無い環境（葉のフレームで待ちを判定する）
+        monkeypatch.setattr(cpu_profile, "_thread_cpu_s", lambda ident: None)
+
+    stop = threading.Event()
+    parked = queue.Queue()
+    threads = [
+        # タスクキューのワーカー・ポーラーのように待っているだけのスレッド
+        threading.Thread(target=parked.get, name="idle-queue"),
+        threading.Thread(target=stop.wait, name="idle-event"),
+        threading.Thread(target=_spin, args=(stop,), name="busy"),
+    ]
+    for t in threads:
+        t.start()
+    try:
+        path = cpu_profile.start(1.0, interval=0.005)
+        assert path is not None
+        _wait_for(path)
+    finally:
+        stop.set()
+        parked.put(None)
+        for t in threads:
+            t.join()
+
+    weights = _read_folded(path)
+    total = sum(weights.values())
+    busy = sum(w for stack, w in weights.items() if "_spin" in stack)
+    assert total > 0
+    assert busy / total > 0.8
+    assert not any(stack.startswith("idle-") for stack in weights)
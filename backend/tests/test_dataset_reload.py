@@ -0,0 +1,98 @@
+"""駅データを繰り返し差し替えながら並行して参照し、作りかけの Dataset が見えないこと
+
+最悪の参照時間は出力するだけで判定しない。参照は再構築のロックを待たないので、
+ここで出る数十〜百数十 ms の遅れは CPU を使い続けるスレッド同士の GIL の
+切り替え待ち（差し替え無しでも同程度）で、差し替えそのものによる停止ではない。
+
+    python -m pytest tests/test_dataset_reload.py -s
+"""
+
+import random
+import threading
+import time
+
+import orjson
+import pytest
+
+import dataset
+import stations
+
+RELOADS = 40
+CONCURRENCY = 4
+
+
+@pytest.fixture
+def station_file(tmp_path):
+    saved = dataset.STATIONS_DATA_PATH
+    path = tmp_path / "stations.json"
+    dataset.STATIONS_DATA_PATH = str(path)
+    try:
+        yield path
+    finally:
+        dataset.STATIONS_DATA_PATH = saved
+        dataset.load()
+
+
+def _variants():
+    variant_a = {"stations": stations.STATIONS, "lines": stations.ALL_LINES}
+    # B は一部の駅を削除・移動したもの
+    variant_b = {
+        "stations": [
+            {**s, "lat": s["lat"] + 0.001} if i % 7 == 0 else s
+            for i, s in enumerate(stations.STATIONS)
+            if i % 11 != 0
+        ],
+        "lines": stations.ALL_LINES,
+    }
+    return variant_a, variant_b
+
+
+def test_lookups_stay_consistent_during_reloads(station_file):
+    variant_a, variant_b = _variants()
+    station_file.write_bytes(orjson.dumps(variant_a))
+    dataset.load()
+
+    stop = threading.Event()
+    errors = []
+    lookups = [0]
+    worst_ms = [0.0]
+
+    def hammer():
+        rng = random.Random()
+        while not stop.is_set():
+            started = time.perf_counter()
+            ds = dataset.current()
+            try:
+                lat = 35.6 + rng.random() * 0.2
+                lng = 139.6 + rng.random() * 0.3
+                assert ds.model.nearest(lat, lng) < len(ds.model)
+                for _, i in ds.geo_index.within_radius(lat, lng, 3.0):
+                    assert ds.stations[i]["lat"] is not None
+                assert len(orjson.loads(ds.encoded("json"))) == len(ds.stations)
+                line_id = rng.choice(ds.lines)["id"]
+                assert all(s["line_id"] == line_id for s in ds.by_line.get(line_id, []))
+            except Exception as e:
+                errors.append(repr(e))
+            worst_ms[0] = max(worst_ms[0], (time.perf_counter() - started) * 1000)
+            lookups[0] += 1
+
+    threads = [threading.Thread(target=hammer) for _ in range(CONCURRENCY)]
+    for t in threads:
+        t.start()
+    versions = set()
+    try:
+        for i in range(RELOADS):
+            variant = variant_b if i % 2 == 0 else variant_a
+            tmp_path = station_file.with_suffix(".tmp")
+            tmp_path.write_bytes(orjson.dumps(variant))
+            tmp_path.replace(station_file)
+            versions.add(dataset.reload().version)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    print(f"reloads={RELOADS} lookups={lookups[0]} worst lookup={worst_ms[0]:.2f}ms")
+    assert errors == []
+    assert len(versions) == 2
+    assert lookups[0] > RELOADS
@@ -0,0 +1,69 @@
+"""ヘッジ付き呼び出し: 締め切り後も走り続ける呼び出しが同時実行数の枠を持ち続けること"""
+
+import threading
+import time
+
+import pytest
+
+import llm_hedge
+import rate_limit
+
+
+def _blocked_caller(admission, gate, started):
+    def call():
+        started.append(1)
+        gate.wait(10)
+        return "ok"
+
+    return llm_hedge.HedgedCaller(
+        call, deadline_s=0.2, default_hedge_delay_s=0.05, admission=admission
+    )
+
+
+def _wait_until(predicate, timeout_s=5):
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_slots_are_held_until_abandoned_calls_finish(tmp_path):
+    admission = rate_limit.AdmissionControl(2, directory=str(tmp_path))
+    gate = threading.Event()
+    started = []
+    caller = _blocked_caller(admission, gate, started)
+
+    with pytest.raises(TimeoutError):
+        caller()
+    # 1本目とヘッジの2本が締め切り後も走っていて、枠を両方とも持っている
+    assert len(started) == 2
+    with pytest.raises(llm_hedge.Overloaded):
+        caller()
+    assert caller.stats()["overloaded"] == 1
+
+    gate.set()
+
+    def slots_free():
+        slots = [admission.try_acquire() for _ in range(2)]
+        for slot in slots:
+            if slot is not None:
+                admission.release(slot)
+        return None not in slots
+
+    _wait_until(slots_free)
+    assert caller() == "ok"
+
+
+def test_hedge_is_skipped_without_a_free_slot(tmp_path):
+    admission = rate_limit.AdmissionControl(1, directory=str(tmp_path))
+    gate = threading.Event()
+    started = []
+    caller = _blocked_caller(admission, gate, started)
+
+    with pytest.raises(TimeoutError):
+        caller()
+    gate.set()
+    stats = caller.stats()
+    assert len(started) == 1
+    assert stats["hedged"] == 0
+    assert stats["hedges_skipped"] == 1
@@ -0,0 +1,53 @@
+"""駅名検索: ビット並列の編集距離と、駅数が数千あるときの誤字許容"""
+
+import random
+import time
+
+from bench import synthetic_stations
+from station_model import StationModel
+from station_search import StationSearch, prefix_edit_distance
+
+
+def _naive_prefix_distance(query, key):
+    previous = list(range(len(query) + 1))
+    best = previous[-1]
+    for j, k in enumerate(key, 1):
+        current = [j]
+        for i, q in enumerate(query, 1):
+            current.append(
+                min(previous[i] + 1, current[i - 1] + 1, previous[i - 1] + (q != k))
+            )
+        best = min(best, current[-1])
+        previous = current
+    return best
+
+
+def test_prefix_edit_distance_matches_dp():
+    rng = random.Random(0)
+    for _ in range(20_000):
+        query = "".join(rng.choices("abcs", k=rng.randint(1, 8)))
+        key = "".join(rng.choices("abcs", k=rng.randint(0, 12)))
+        limit = rng.randint(0, 3)
+        expected = _naive_prefix_distance(query, key)
+        assert prefix_edit_distance(query, key, limit) == (
+            expected if expected <= limit else None
+        )
+
+
+def _synthetic_search(n):
+    station_list, lines = synthetic_stations(n)
+    model = StationModel(station_list, lines)
+    return model, StationSearch(model, station_list)
+
+
+def test_fuzzy_search_at_a_few_thousand_stations():
+    model, search = _synthetic_search(3000)
+    for query, expected in (("shibya", "渋谷駅"), ("sinjuku", "新宿駅")):
+        results = search.search(query, 35.68, 139.76)
+        assert model.names[results[0][0]] == expected
+
+    # 時間は環境に左右されるので緩めに（手元では 1 ms 未満。bench.py search を参照）
+    started = time.perf_counter()
+    for _ in range(20):
+        search.search("shibya", 35.68, 139.76)
+    assert (time.perf_counter() - started) / 20 < 0.02
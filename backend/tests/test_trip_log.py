@@ -0,0 +1,31 @@
+"""乗車時間の実測: 1人の送信で駅ペアの学習値を大きく動かせないこと"""
+
+import trip_log
+
+
+def _estimate(origin, destination):
+    # 有楽町→新宿 の距離からの推定に相当
+    return 11 if {origin, destination} <= {"有楽町駅", "新宿駅"} else None
+
+
+def _trip(minutes, origin="有楽町駅", destination="新宿駅"):
+    return {"origin": origin, "destination": destination, "minutes": minutes, "hour": 8}
+
+
+def test_implausible_and_repeated_pairs_are_rejected():
+    valid, rejected = trip_log.validate_trips(
+        [_trip(240), _trip(12), _trip(13), _trip(12, "有楽町駅", "大阪駅")],
+        _estimate,
+    )
+    assert [t["minutes"] for t in valid] == [12]
+    assert rejected == 3
+
+
+def test_learned_minutes_resist_outliers(tmp_path):
+    store = trip_log.TripStore(str(tmp_path))
+    store.append([_trip(m) for m in (10, 11, 12, 11, 10)])
+    # 推定の範囲内で最も大きい値を何回か送っても、中央値はほとんど動かない
+    store.append([_trip(33), _trip(33), _trip(33)])
+    store.refresh(force=True)
+    assert store.learned_minutes("有楽町駅", "新宿駅") <= 12
+    assert store.learned_minutes("有楽町駅", "新宿駅", hour=8) <= 12
@@ -0,0 +1,65 @@
+"""「いちばん早く着けるトイレのある駅」のランキング（NumPy で一括計算）
+
+発作が起きたときに知りたいのは、UI で選んだ駅への行き方ではなく、今いる場所から
+最短で着けるトイレのある駅。全物理駅について
+
+    距離（ハバーサイン） → 所要時間（main.estimate_travel_minutes と同じ式）
+    → 駅 × 時間帯の混雑度（congestion_index）による上乗せ
+
+をベクトル演算1回で計算し、argpartition で上位 k 件だけを並べる。LLM は呼ばない。
+"""
+
+import numpy as np
+
+from congestion_index import MINUTES_PER_LEVEL
+from geo_index import EARTH_RADIUS_KM
+
+# main.estimate_travel_minutes と同じ仮定（時速20km + 乗り換え・待ち5分）
+SPEED_KMH = 20
+BASE_MINUTES = 5
+
+
+class ToiletRanker:
+    def __init__(self, model, station_list):
+        self.model = model
+        self.lat = np.radians(np.asarray(model.lat, dtype=np.float64))
+        self.lng = np.radians(np.asarray(model.lng, dtype=np.float64))
+        self.cos_lat = np.cos(self.lat)
+
+        # トイレの有無。データに has_toilet が無い駅はあるものとみなす
+        # （同じ物理駅のどれかの路線レコードで有りなら有り）
+        has_toilet = np.zeros(len(model), dtype=bool)
+        for record_index, s in enumerate(station_list):
+            if s.get("has_toilet", True):
+                has_toilet[model.record_station[record_index]] = True
+        self.has_toilet = has_toilet
+
+    def distances_km(self, lat, lng):
+        """全物理駅までの距離（km）の配列（geo_index.haversine_km を全駅に一括で）"""
+        lat1, lng1 = np.radians(lat), np.radians(lng)
+        a = (
+            np.sin((self.lat - lat1) / 2) ** 2
+            + np.cos(lat1) * self.cos_lat * np.sin((self.lng - lng1) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    def rank(self, lat, lng, k=5, congestion_levels=0):
+        """到着が早い順に [(物理駅 id, 距離km, 所要分), ...] を返す
+
+        congestion_levels は全駅共通の混雑度か、物理駅ごとの混雑度の配列
+        （CongestionIndex.column(時)）。
+        """
+        distances = self.distances_km(lat, lng)
+        minutes = (
+            np.maximum(1, np.floor(distances / SPEED_KMH * 60 + BASE_MINUTES))
+            + np.asarray(congestion_levels) * MINUTES_PER_LEVEL
+        )
+        minutes[~self.has_toilet] = np.inf
+
+        k = min(k, int(self.has_toilet.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(minutes, k - 1)[:k]
+        # 所要時間が同じなら近い方を先にする
+        top = top[np.lexsort((distances[top], minutes[top]))]
+        return [(int(i), float(distances[i]), float(minutes[i])) for i in top]
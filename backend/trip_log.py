@@ -0,0 +1,208 @@
+"""実際の乗車時間の記録と学習（ログ構造ストア + ストリーミング集計）
+
+estimate_travel_minutes は時速20km + 5分の固定式で、実測からのフィードバックが
+無い。利用者が同意した場合のみ（出発駅, 目的駅, 実際の分数, 時間帯）を受け取り、
+
+- 追記専用のセグメントファイル（JSONL）に書き込む。O_APPEND の1回の write なので
+  複数ワーカーが同時に書いても行は混ざらない
+- 各ワーカーはセグメントを末尾から追いかけて読み、駅ペアごと・ペア×時間帯ごとに
+  件数・平均・分散（Welford）と指数移動平均、直近 RECENT_SAMPLES 件を一定の
+  メモリで更新する
+
+誰でも送れるので、距離からの推定から大きく外れた値は受け付けず、1回の送信で
+同じ駅ペアは1件だけ数える。学習値には外れ値に強い直近の中央値を使う。
+
+個人を特定できる情報（位置・IP・時刻）は保存しない。時間帯は時（0-23）のみ。
+"""
+
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+import orjson
+
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+# 学習値を使い始める最小件数
+MIN_SAMPLES = 3
+# 学習値（中央値）の計算に使う直近の件数
+RECENT_SAMPLES = 15
+# 距離からの推定（estimate_travel_minutes）に対して実測として認める範囲（倍率）
+PLAUSIBLE_MIN_RATIO = 0.25
+PLAUSIBLE_MAX_RATIO = 3.0
+# 指数移動平均の重み（新しい実測ほど重くする）
+EWMA_ALPHA = 0.2
+# 他ワーカーが書いたログを取り込む間隔（秒）
+REFRESH_INTERVAL = 5
+
+
+class RunningStats:
+    """件数・平均・分散・指数移動平均と直近 RECENT_SAMPLES 件を一定のメモリで更新する"""
+
+    __slots__ = ("count", "mean", "m2", "ewma", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, value):
+        self.recent.append(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.ewma = (
+            value
+            if self.ewma is None
+            else (EWMA_ALPHA * value + (1 - EWMA_ALPHA) * self.ewma)
+        )
+
+    @property
+    def stddev(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+    @property
+    def median(self):
+        """直近の値の中央値（少数の極端な値に引きずられない）"""
+        return statistics.median(self.recent) if self.recent else None
+
+
+class TripStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._last_refresh = 0.0
+        self.pairs = {}
+        self.pair_hours = {}
+        self.refresh(force=True)
+
+    # --- 書き込み ---
+
+    def _segments(self):
+        return sorted(
+            name
+            for name in os.listdir(self.directory)
+            if name.startswith("trips-") and name.endswith(".jsonl")
+        )
+
+    def _active_segment(self):
+        segments = self._segments()
+        if segments:
+            path = os.path.join(self.directory, segments[-1])
+            if os.path.getsize(path) < SEGMENT_MAX_BYTES:
+                return path
+            number = int(segments[-1][len("trips-") : -len(".jsonl")]) + 1
+        else:
+            number = 0
+        return os.path.join(self.directory, f"trips-{number:06d}.jsonl")
+
+    def append(self, trips):
+        """検証済みの実測値のリストをログに追記する"""
+        if not trips:
+            return
+        data = b"".join(orjson.dumps(t) + b"\n" for t in trips)
+        fd = os.open(self._active_segment(), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    # --- 集計 ---
+
+    def _add(self, trip):
+        pair = (trip["origin"], trip["destination"])
+        self.pairs.setdefault(pair, RunningStats()).add(trip["minutes"])
+        self.pair_hours.setdefault((*pair, trip["hour"]), RunningStats()).add(
+            trip["minutes"]
+        )
+
+    def refresh(self, force=False):
+        """全セグメントの未読部分を取り込む（自分以外のワーカーが書いた分も含む）"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < REFRESH_INTERVAL:
+            return
+        with self._lock:
+            self._last_refresh = now
+            for name in self._segments():
+                path = os.path.join(self.directory, name)
+                offset = self._offsets.get(name, 0)
+                if os.path.getsize(path) <= offset:
+                    continue
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    chunk = f.read()
+                # 書きかけの最終行は次回に回す
+                complete = chunk.rfind(b"\n") + 1
+                for line in chunk[:complete].splitlines():
+                    try:
+                        self._add(orjson.loads(line))
+                    except (orjson.JSONDecodeError, KeyError, TypeError):
+                        continue
+                self._offsets[name] = offset + complete
+
+    def learned_minutes(self, origin, destination, hour=None):
+        """実測から学習した所要時間（直近の中央値、分）。件数が足りなければ None"""
+        self.refresh()
+        if hour is not None:
+            stats = self.pair_hours.get((origin, destination, hour))
+            if stats is not None and stats.count >= MIN_SAMPLES:
+                return stats.median
+        stats = self.pairs.get((origin, destination))
+        if stats is not None and stats.count >= MIN_SAMPLES:
+            return stats.median
+        return None
+
+
+def plausible_minutes(minutes, estimated):
+    """距離からの推定 estimated（分）に対して、実測としてありうる値か"""
+    return (
+        1 <= minutes <= 240
+        and estimated * PLAUSIBLE_MIN_RATIO
+        <= minutes
+        <= estimated * PLAUSIBLE_MAX_RATIO
+    )
+
+
+def validate_trips(raw_trips, estimate_minutes, max_trips=100):
+    """受け取った実測値を検証・匿名化する。(有効なリスト, 却下数) を返す
+
+    estimate_minutes(出発駅, 目的駅) は出発駅の地域の距離から推定した所要時間で、
+    どちらかの駅を知らなければ None。同じ駅ペアは1回の送信で1件だけ受け付ける。
+    """
+    valid = []
+    rejected = 0
+    seen_pairs = set()
+    for raw in (raw_trips or [])[:max_trips]:
+        try:
+            trip = {
+                "origin": str(raw["origin"]),
+                "destination": str(raw["destination"]),
+                # 分単位に丸めて保存する（秒単位の値は個人の特定につながりうる）
+                "minutes": round(float(raw["minutes"])),
+                "hour": int(raw["hour"]),
+            }
+        except (KeyError, TypeError, ValueError, OverflowError):
+            # OverflowError は inf（"minutes": "inf" など）を丸めたとき
+            rejected += 1
+            continue
+        pair = (trip["origin"], trip["destination"])
+        if trip["origin"] == trip["destination"] or pair in seen_pairs:
+            rejected += 1
+            continue
+        estimated = estimate_minutes(*pair)
+        if (
+            estimated is not None
+            and plausible_minutes(trip["minutes"], estimated)
+            and 0 <= trip["hour"] <= 23
+        ):
+            seen_pairs.add(pair)
+            valid.append(trip)
+        else:
+            rejected += 1
+    return valid, rejected
@@ -0,0 +1,52 @@
+"""駅データのバージョン（内容ハッシュ）と差分計算
+
+クライアントは手元のバージョンを since= で送り、サーバーは追加・変更・削除
+された駅だけを返す。データがほとんど変わらないので、地下の弱い電波でも
+数百バイトで同期できる。
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+
+
+def _canonical(obj):
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def body_version(body):
+    """エンコード済みの bytes からバージョン文字列を作る"""
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+def dataset_version(station_list):
+    """駅リストの内容から決まるバージョン文字列（並び順に依存しない）"""
+    ordered = sorted(station_list, key=lambda s: str(s.get("id")))
+    return body_version(_canonical(ordered).encode())
+
+
+def diff(old_list, new_list):
+    """id をキーに2つの駅リストを比べ、(追加, 変更, 削除id) を返す"""
+    old = {s["id"]: s for s in old_list}
+    new = {s["id"]: s for s in new_list}
+    added = [s for sid, s in new.items() if sid not in old]
+    changed = [s for sid, s in new.items() if sid in old and old[sid] != s]
+    removed = [sid for sid in old if sid not in new]
+    return added, changed, removed
+
+
+class VersionHistory:
+    """直近いくつかのバージョンの駅リストを保持する（古いものから捨てる）"""
+
+    def __init__(self, max_versions=32):
+        self.max_versions = max_versions
+        self._snapshots = OrderedDict()
+
+    def record(self, version, station_list):
+        self._snapshots[version] = station_list
+        self._snapshots.move_to_end(version)
+        while len(self._snapshots) > self.max_versions:
+            self._snapshots.popitem(last=False)
+
+    def get(self, version):
+        return self._snapshots.get(version)
@@ -0,0 +1,77 @@
+"""駅データのコンパクトな転送形式
+
+通常の JSON はキー（id, name, ...）を駅ごとに繰り返すため、バイト数の大半が
+キー名になる。ここでは列指向（項目ごとの並列配列）に並べ替え、路線は辞書に
+まとめて番号で参照し、座標は 1e-6 度単位の int32 固定小数点にする。
+
+- columnar: 列指向 JSON（application/vnd.ibs.columnar+json）
+- msgpack:  同じ構造の MessagePack。座標列は int32 リトルエンディアンの生バイト
+"""
+
+import struct
+
+import msgpack
+import orjson
+
+COORD_SCALE = 1_000_000
+
+MIMETYPES = {
+    "json": "application/json",
+    "columnar": "application/vnd.ibs.columnar+json",
+    "msgpack": "application/x-msgpack",
+}
+
+# Accept ヘッダで受け付ける別名
+_ACCEPT_ALIASES = {
+    "application/vnd.ibs.columnar+json": "columnar",
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+
+
+def negotiate(accept_header, format_param=None):
+    """クエリの format= を優先し、なければ Accept ヘッダから形式を決める"""
+    if format_param in MIMETYPES:
+        return format_param
+    for part in (accept_header or "").split(","):
+        mimetype = part.split(";")[0].strip().lower()
+        if mimetype in _ACCEPT_ALIASES:
+            return _ACCEPT_ALIASES[mimetype]
+    return "json"
+
+
+def _fixed(value):
+    return int(round(value * COORD_SCALE))
+
+
+def to_columns(station_list, line_list):
+    """駅リストを列指向の dict に変換する"""
+    line_ids = [l["id"] for l in line_list]
+    line_index = {line_id: i for i, line_id in enumerate(line_ids)}
+    return {
+        "scale": COORD_SCALE,
+        "lines": {"id": line_ids, "color": [l["color"] for l in line_list]},
+        "id": [s["id"] for s in station_list],
+        "name": [s["name"] for s in station_list],
+        "name_en": [s.get("name_en", "") for s in station_list],
+        "line": [line_index.get(s["line_id"], -1) for s in station_list],
+        "lat": [_fixed(s["lat"]) for s in station_list],
+        "lng": [_fixed(s["lng"]) for s in station_list],
+    }
+
+
+def encode(station_list, line_list, fmt):
+    """駅リストを指定形式の bytes にエンコードする"""
+    if fmt == "json":
+        return orjson.dumps(station_list)
+
+    columns = to_columns(station_list, line_list)
+    if fmt == "columnar":
+        return orjson.dumps(columns)
+
+    # msgpack では座標列を int32 配列の生バイトにし、1座標あたり4バイトに収める
+    count = len(station_list)
+    columns["lat"] = struct.pack(f"<{count}i", *columns["lat"])
+    columns["lng"] = struct.pack(f"<{count}i", *columns["lng"])
+    return msgpack.packb(columns, use_bin_type=True)
@@ -1,18 +1,52 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import "./App.css";
 
 const API_BASE_URL =
   process.env.NODE_ENV === "development" ? "http://localhost:5000" : "";
 
+// タブごとのセッション ID（サーバー側のレート制限と予測の先読みの単位）
+const getSessionId = () => {
+  let id = sessionStorage.getItem("sessionId");
+  if (!id) {
+    id =
+      window.crypto && window.crypto.randomUUID
+        ? window.crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem("sessionId", id);
+  }
+  return id;
+};
+
 function App() {
   const [lines, setLines] = useState([]);
   const [allStations, setAllStations] = useState([]);
   const [selectedLineStations, setSelectedLineStations] = useState([]);
   const [navigationData, setNavigationData] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
+  // 最後に取得できた現在地（路線を開いたときにサーバーへ渡して予測を先読みさせる）
+  const lastPosRef = useRef(null);
 
   // 初回ロード時に路線一覧を取得
   useEffect(() => {
+    // 位置情報が既に許可されていれば、現在地を控えておく（ここでは許可を求めない）
+    if (navigator.permissions && navigator.geolocation) {
+      navigator.permissions
+        .query({ name: "geolocation" })
+        .then((status) => {
+          if (status.state !== "granted") return;
+          navigator.geolocation.getCurrentPosition(
+            (pos) => {
+              lastPosRef.current = {
+                lat: pos.coords.latitude,
+                lng: pos.coords.longitude,
+              };
+            },
+            () => {},
+            { maximumAge: 60000 }
+          );
+        })
+        .catch(() => {});
+    }
     fetch(`${API_BASE_URL}/api/lines`)
       .then((res) => res.json())
       .then((data) => setLines(data))
@@ -28,7 +62,13 @@ function App() {
   const handleLineClick = async (lineId) => {
     setIsLoading(true);
     try {
-      const res = await fetch(`${API_BASE_URL}/api/stations?line_id=${lineId}`);
+      // 現在地が分かっていれば添えて、サーバーに近くの駅の予測を先に作らせる
+      const pos = lastPosRef.current;
+      const query = pos ? `&lat=${pos.lat}&lng=${pos.lng}` : "";
+      const res = await fetch(
+        `${API_BASE_URL}/api/stations?line_id=${lineId}${query}`,
+        { headers: { "X-Session-Id": getSessionId() } }
+      );
       const data = await res.json();
       setSelectedLineStations(data);
     } catch (err) {
@@ -69,6 +109,8 @@ function App() {
         });
       }
 
+      lastPosRef.current = finalPos;
+
       const payload = {
         station_name: station.name,
         station_lat: station.lat,
@@ -80,7 +122,10 @@ function App() {
 
       const res = await fetch(`${API_BASE_URL}/api/gpt-prediction`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: {
+          "Content-Type": "application/json",
+          "X-Session-Id": getSessionId(),
+        },
         body: JSON.stringify(payload),
       });
 